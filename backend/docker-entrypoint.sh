@@ -12,9 +12,15 @@ tail -n 0 -f /var/log/backend/*.log &
 # Make sure the data directories exist
 mkdir -p /movies/triage
 mkdir -p /movies/library
+mkdir -p /movies/conversions
 
-# Convert movies in the background
+# Convert movies in the background. The converter is woken up when a conversion is queued.
 python3 /var/backend/src/manage.py convert_new_movies &
+
+# Download movie covers and create their thumbnails in the background
+python3 /var/backend/src/manage.py download_covers &
+
+# Set the duration of movies converted before durations were set by the converter
 python3 /var/backend/src/manage.py set_duration &
 
 # Capture cron logs
@@ -1,55 +1,122 @@
 from base64 import b64decode
+from django.conf import settings
 from django.contrib.auth import authenticate
+from django.contrib.auth.signals import user_logged_out
+from django.core.cache import cache
+from django.dispatch import receiver
 from django.http import HttpResponseRedirect, HttpResponse, JsonResponse
 from django.views import View
 from urllib.parse import urlparse
+import binascii
+import hashlib
 import logging
 import re
 import urllib.parse
 
 
-permission_checks = (("^/torrents", "authentication.torrents"),)
+# URLs that anyone can access, without loading the session
+public_paths = (
+    "/auth/",
+    # Enable unauthenticated access to movie files, for Apple TV and Chromecast to work
+    "/movies/",
+)
+superuser_paths = ("/timeline", "/files", "/vacuum")
+permission_checks = ((re.compile("^/torrents"), "authentication.torrents"),)
+
+# Caddy verifies every request, including every chunk of a video. Allowed requests are cached for a short time, so
+# that permission changes still apply quickly.
+verify_cache_ttl = 30  # Seconds
 
 logger = logging.getLogger(__name__)
 
 
+def get_url_class(path: str) -> str:
+    """
+    Groups URLs that have the same access rules. Returns "public", "superuser", "user", or a required permission.
+    """
+    if path.startswith(public_paths):
+        return "public"
+    for url_matcher, permission in permission_checks:
+        if url_matcher.match(path):
+            return permission
+    if path.startswith(superuser_paths):
+        return "superuser"
+    return "user"
+
+
+def has_access(user, url_class: str) -> bool:
+    if url_class == "public" or url_class == "user":
+        return True
+    elif url_class == "superuser":
+        return user.is_superuser
+    return user.has_perm(url_class)
+
+
+def get_verify_cache_key(session_key: str, auth_header: str, url_class: str) -> str:
+    credentials_hash = hashlib.sha256(f"{session_key}\n{auth_header}".encode("utf-8")).hexdigest()
+    return f"auth-verify:{credentials_hash}:{url_class}"
+
+
+def get_basic_auth_user(request):
+    # OwnTracks uses basic auth for GPS pings
+    auth_header = request.META.get("HTTP_AUTHORIZATION")
+    if not auth_header or not auth_header.startswith("Basic "):
+        return None
+
+    try:
+        encoded = auth_header.split(" ", 1)[1].strip()
+        username, password = b64decode(encoded).decode("utf-8").split(":", 1)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    return authenticate(request, username=username, password=password)
+
+
+def continue_response() -> HttpResponse:
+    response = HttpResponse()
+    response["Cache-Control"] = f"private, max-age={verify_cache_ttl}"
+    response["Vary"] = "Cookie, Authorization"
+    return response
+
+
 def check_auth(request):
     original_url = request.META.get("HTTP_X_FORWARDED_URI")
-    login_url = "/auth/?next=" + urllib.parse.quote_plus(original_url)
+    if not original_url:
+        return HttpResponseRedirect("/auth/", status=302)
 
-    continue_response = HttpResponse()
-    login_response = HttpResponseRedirect(login_url, status=302)
+    login_response = HttpResponseRedirect("/auth/?next=" + urllib.parse.quote_plus(original_url), status=302)
 
-    if not original_url:
-        return login_response
-    elif original_url.startswith("/auth/"):
-        return continue_response
+    url_class = get_url_class(urlparse(original_url).path)
+    if url_class == "public":
+        return continue_response()
 
-    parsed_url = urlparse(original_url)
+    # The session is not loaded if the same credentials were recently verified
+    session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME, "")
+    auth_header = request.META.get("HTTP_AUTHORIZATION", "")
+    if not session_key and not auth_header:
+        return login_response
 
-    if request.user.is_authenticated:
-        for url_matcher, permission in permission_checks:
-            if re.match(url_matcher, original_url) and not request.user.has_perm(permission):
-                return login_response
+    cache_key = get_verify_cache_key(session_key, auth_header, url_class)
+    if cache.get(cache_key):
+        return continue_response()
 
-        if parsed_url.path.startswith(("/timeline", "/files", "/vacuum")) and not request.user.is_superuser:
-            return login_response
+    # Also accept basic auth as a fallback
+    user = request.user if request.user.is_authenticated else get_basic_auth_user(request)
+    if not user or not has_access(user, url_class):
+        return login_response
 
-        return continue_response
-    else:
-        # Enable unauthenticated access to movie files, for Apple TV and Chromecast to work
-        if parsed_url.path.startswith("/movies/"):
-            return continue_response
+    cache.set(cache_key, True, verify_cache_ttl)
+    return continue_response()
 
-        # Also accept basic auth as a fallback. OwnTracks uses basic auth for GPS pings.
-        auth_header = request.META.get("HTTP_AUTHORIZATION")
-        if not auth_header or not auth_header.startswith("Basic "):
-            return login_response
 
-        encoded = auth_header.split(" ", 1)[1].strip()
-        username, password = b64decode(encoded).decode("utf-8").split(":", 1)
-        user = authenticate(request, username=username, password=password)
-        return continue_response if user else login_response
+@receiver(user_logged_out)
+def forget_verified_session(sender, request, user, **kwargs):
+    """
+    Don't let a session access anything after logging out, even if it was recently verified
+    """
+    url_classes = ["user", "superuser", *(permission for url_matcher, permission in permission_checks)]
+    session_key = request.session.session_key or ""
+    auth_header = request.META.get("HTTP_AUTHORIZATION", "")
+    cache.delete_many([get_verify_cache_key(session_key, auth_header, url_class) for url_class in url_classes])
 
 
 class JSONPermissionsView(View):
@@ -14,8 +14,10 @@ MOVIE_LIBRARY_PATH = Path("/movies/library")
 MOVIE_LIBRARY_URL = "/movies"
 
 GPX_LOGS_PATH = Path("/var/log/gps")
+GPS_ARCHIVE_PATH = GPX_LOGS_PATH / "archive"
 DATABASE_PATH = Path("/var/backend/db/api.db")
 DATABASE_BACKUPS_PATH = Path("/var/backend/db-backups")
+DATABASE_BACKUP_RETENTION_DAYS = 30
 
 VIDEO_EXTENSIONS = (
     ".3gp",
@@ -34,6 +36,16 @@ VIDEO_EXTENSIONS = (
 )
 SUBTITLE_EXTENSIONS = (".srt", ".vtt")
 
+# Number of videos converted at the same time, and the number of CPU threads each conversion can use.
+# None divides the CPU cores between the conversions.
+CONVERSION_WORKERS = int(os.environ.get("BACKEND_CONVERSION_WORKERS", 2))
+CONVERSION_THREADS_PER_JOB = None
+CONVERSION_HLS = os.environ.get("BACKEND_CONVERSION_HLS", False) == "1"  # Also create 1080/720/480p HLS streams
+CONVERSION_MAX_ATTEMPTS = 3  # Failed conversions are retried this many times
+CONVERTER_SOCKET_PATH = Path("/tmp/converter.sock")  # Wakes up the converter when a conversion is queued
+CONVERSION_WORK_PATH = Path("/movies/conversions")  # Segments of unfinished conversions
+COVER_DOWNLOADER_SOCKET_PATH = Path("/tmp/cover-downloader.sock")  # Wakes up the cover downloader
+
 LOGIN_REDIRECT_URL = "/"
 
 SECRET_KEY = os.environ.get("BACKEND_SECRET_KEY", False)
@@ -132,11 +144,33 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": DATABASE_PATH,
+        "CONN_MAX_AGE": 600,  # Reuse connections instead of reconnecting and running the pragmas on each request
+        "CONN_HEALTH_CHECKS": True,
         "OPTIONS": {
             "timeout": 20,  # Longer timeout prevents "Database is locked" errors
+            # Take the write lock when a transaction starts. A transaction that reads then writes can't wait for
+            # another writer to finish, so it fails with "Database is locked" instead.
+            "transaction_mode": "IMMEDIATE",
+            "init_command": ";".join(
+                [
+                    "PRAGMA journal_mode=WAL",  # Readers don't block writers, and writers don't block readers
+                    "PRAGMA synchronous=NORMAL",  # Safe in WAL mode. Commits don't wait for fsync.
+                    "PRAGMA mmap_size=268435456",  # 256 MB
+                    "PRAGMA cache_size=-32000",  # 32 MB
+                ]
+            ),
         },
     }
 }
+# Shared by all gunicorn workers, so that removing a cache entry applies to all of them. It only holds short-lived
+# data, like recent authentication checks.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": "/tmp/backend-cache",
+        "OPTIONS": {"MAX_ENTRIES": 1000},
+    }
+}
 LANGUAGE_CODE = "en-us"
 TIME_ZONE = "UTC"
 USE_I18N = True
@@ -2,16 +2,21 @@ from django.conf.urls import include
 from django.urls import path
 from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 from django.contrib import admin
-from gps_logger.views import GpsLoggerView
+from gps_logger.views import GpsLoggerView, GpsTrackView
 from movies.views import (
     SystemStatsView,
+    EpisodePrioritizeConversionView,
     EpisodeProgressView,
+    EpisodeProgressBatchView,
     MovieListView,
+    MovieUserStateView,
+    ConversionStatusView,
     EpisodeView,
     EpisodeUnwatchedView,
     EpisodeWatchedView,
     TriageListView,
     TriageIgnoreView,
+    TriageParseView,
     EpisodeUnstarView,
     EpisodeStarView,
     DeleteOriginalVideoView,
@@ -20,14 +25,20 @@ from movies.views import (
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/gps/", GpsLoggerView.as_view()),
+    path("api/gps/track/", GpsTrackView.as_view()),
     path("api/movies/", MovieListView.as_view()),
+    path("api/movies/user-state/", MovieUserStateView.as_view()),
     path("api/movies/<int:id>/star/", EpisodeStarView.as_view()),
     path("api/movies/<int:id>/unstar/", EpisodeUnstarView.as_view()),
     path("api/movies/triage/", TriageListView.as_view()),
     path("api/movies/triage/ignore/", TriageIgnoreView.as_view()),
+    path("api/movies/triage/parse/", TriageParseView.as_view()),
     path("api/system/", SystemStatsView.as_view()),
+    path("api/conversions/", ConversionStatusView.as_view()),
+    path("api/episodes/progress/", EpisodeProgressBatchView.as_view()),
     path("api/episodes/<int:id>/", EpisodeView.as_view()),
     path("api/episodes/<int:id>/original/", DeleteOriginalVideoView.as_view()),
+    path("api/episodes/<int:id>/prioritize/", EpisodePrioritizeConversionView.as_view()),
     path("api/episodes/<int:id>/progress/", EpisodeProgressView.as_view()),
     path("api/episodes/<int:id>/unwatched/", EpisodeUnwatchedView.as_view()),
     path("api/episodes/<int:id>/watched/", EpisodeWatchedView.as_view()),
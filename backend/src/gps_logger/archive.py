@@ -0,0 +1,155 @@
+"""
+Compact archives of the GPS points of a day. Each day is a `YYYY-MM-DD.track` file:
+
+- Header: b"GPST", version (uint16), source count (uint16), point count (uint32), bounding box (4 x int32
+  microdegrees: min latitude, min longitude, max latitude, max longitude)
+- Columns, one value per point, sorted by time:
+  - timestamps (uint32)
+  - latitudes and longitudes in microdegrees (int32), as the difference with the previous point
+  - elevations in meters (int16), -32768 if unknown
+  - index of the point's source in the list of sources (uint8)
+- The sources, separated by newlines (UTF-8)
+
+All numbers are little-endian. The columns can be memory-mapped, for example with
+numpy.memmap(path, dtype="<u4", offset=28, shape=point_count) for the timestamps.
+"""
+
+import mmap
+import struct
+import sys
+from array import array
+from datetime import date
+from itertools import accumulate
+from pathlib import Path
+from typing import Iterator
+
+from django.conf import settings
+
+# (timestamp, latitude, longitude, elevation)
+TrackPoint = tuple[int, float, float, int | None]
+
+header_format = struct.Struct("<4sHHIiiii")
+archive_magic = b"GPST"
+archive_version = 1
+unknown_elevation = -32768
+
+
+def archive_path(day: date) -> Path:
+    return Path(settings.GPS_ARCHIVE_PATH) / f"{day.strftime('%Y-%m-%d')}.track"
+
+
+def archived_days() -> list[date]:
+    archive_dir = Path(settings.GPS_ARCHIVE_PATH)
+    if not archive_dir.exists():
+        return []
+    return sorted(date.fromisoformat(path.stem) for path in archive_dir.glob("*.track"))
+
+
+def to_microdegrees(value: float) -> int:
+    return round(value * 1_000_000)
+
+
+def write_archive(path: Path, points: list[tuple[TrackPoint, str]]):
+    """
+    Writes an archive of (point, source) tuples sorted by time. The old archive is replaced once the new one is written.
+    """
+    sources = sorted({source for point, source in points})
+    if len(sources) > 255:
+        raise ValueError(f"Too many sources in one day ({len(sources)})")
+    source_indexes = {source: index for index, source in enumerate(sources)}
+
+    timestamps, latitude_deltas, longitude_deltas = array("I"), array("i"), array("i")
+    elevations, point_sources = array("h"), array("B")
+    latitudes, longitudes = [], []
+    previous_latitude = previous_longitude = 0
+    for (timestamp, latitude, longitude, elevation), source in points:
+        latitude, longitude = to_microdegrees(latitude), to_microdegrees(longitude)
+        timestamps.append(timestamp)
+        latitude_deltas.append(latitude - previous_latitude)
+        longitude_deltas.append(longitude - previous_longitude)
+        elevations.append(unknown_elevation if elevation is None else max(-32767, min(32767, round(elevation))))
+        point_sources.append(source_indexes[source])
+        latitudes.append(latitude)
+        longitudes.append(longitude)
+        previous_latitude, previous_longitude = latitude, longitude
+
+    columns = (timestamps, latitude_deltas, longitude_deltas, elevations, point_sources)
+    if sys.byteorder != "little":
+        for column in columns:
+            column.byteswap()
+
+    bbox = (min(latitudes), min(longitudes), max(latitudes), max(longitudes)) if points else (0, 0, 0, 0)
+    tmp_path = path.with_suffix(".tmp")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tmp_path.open("wb") as archive_file:
+        archive_file.write(header_format.pack(archive_magic, archive_version, len(sources), len(points), *bbox))
+        for column in columns:
+            archive_file.write(column.tobytes())
+        archive_file.write("\n".join(sources).encode("utf-8"))
+    tmp_path.rename(path)
+
+
+class TrackArchive:
+    """
+    A memory-mapped archive. The columns are only read from the disk when they are used.
+    """
+
+    def __init__(self, path: Path):
+        self.file = path.open("rb")
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, source_count, self.point_count, *bbox = header_format.unpack_from(self.mmap)
+        if magic != archive_magic or version != archive_version:
+            self.close()
+            raise ValueError(f"{path} is not a GPS track archive")
+        if sys.byteorder != "little":
+            self.close()
+            raise NotImplementedError("GPS track archives can only be read on little-endian systems")
+
+        # min latitude, min longitude, max latitude, max longitude
+        self.bbox = tuple(value / 1_000_000 for value in bbox)
+
+        self.views = [memoryview(self.mmap)]
+        offset = header_format.size
+        for name, type_code in (
+            ("timestamps", "I"),
+            ("latitude_deltas", "i"),
+            ("longitude_deltas", "i"),
+            ("elevations", "h"),
+            ("point_sources", "B"),
+        ):
+            size = self.point_count * array(type_code).itemsize
+            column = self.views[0][offset : offset + size].cast(type_code)
+            self.views.append(column)
+            setattr(self, name, column)
+            offset += size
+        self.sources = self.mmap[offset:].decode("utf-8").split("\n") if source_count else []
+
+    def points(self) -> Iterator[tuple[TrackPoint, str]]:
+        for timestamp, latitude, longitude, elevation, source_index in zip(
+            self.timestamps,
+            accumulate(self.latitude_deltas),
+            accumulate(self.longitude_deltas),
+            self.elevations,
+            self.point_sources,
+        ):
+            yield (
+                (
+                    timestamp,
+                    round(latitude / 1_000_000, 6),
+                    round(longitude / 1_000_000, 6),
+                    None if elevation == unknown_elevation else elevation,
+                ),
+                self.sources[source_index],
+            )
+
+    def close(self):
+        for view in reversed(getattr(self, "views", [])):
+            view.release()
+        self.mmap.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
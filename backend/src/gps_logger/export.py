@@ -0,0 +1,156 @@
+import fcntl
+import logging
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta, timezone
+from pathlib import Path
+from typing import Iterable
+
+import gpxpy.gpx
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+
+from .archive import TrackArchive, TrackPoint, archive_path, write_archive
+from .models import GpsPoint, GpxExport
+
+logger = logging.getLogger(__name__)
+
+
+def day_range(day: date) -> tuple[datetime, datetime]:
+    """
+    GPX logs are split by UTC day
+    """
+    start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+    return start, start + timedelta(days=1)
+
+
+def gpx_path(day: date) -> Path:
+    return Path(settings.GPX_LOGS_PATH) / f"{day.strftime('%Y-%m-%d')}.gpx"
+
+
+def read_gpx(path: Path) -> list[tuple[TrackPoint, str]]:
+    with path.open("r") as gpx_file:
+        gpx = gpxpy.parse(gpx_file)
+    return [
+        (
+            (
+                int(point.time.replace(tzinfo=point.time.tzinfo or timezone.utc).timestamp()),
+                point.latitude,
+                point.longitude,
+                None if point.elevation is None else round(point.elevation),
+            ),
+            point.source or "",
+        )
+        for track in gpx.tracks
+        for segment in track.segments
+        for point in segment.points
+        if point.time
+    ]
+
+
+def render_gpx(points: Iterable[tuple[TrackPoint, str]]) -> str:
+    gpx = gpxpy.gpx.GPX()
+    gpx.tracks.append(gpxpy.gpx.GPXTrack())
+    gpx.tracks[-1].segments.append(gpxpy.gpx.GPXTrackSegment())
+    for (timestamp, latitude, longitude, elevation), source in points:
+        gpx_point = gpxpy.gpx.GPXTrackPoint(
+            latitude=latitude,
+            longitude=longitude,
+            elevation=elevation,
+            time=datetime.fromtimestamp(timestamp, tz=timezone.utc),
+        )
+        gpx_point.source = source
+        gpx.tracks[-1].segments[-1].points.append(gpx_point)
+    return gpx.to_xml()
+
+
+def get_day_points(day: date, last_point_id: int) -> list[tuple[TrackPoint, str]]:
+    """
+    Returns the archived points of a day and the points in the database up to `last_point_id`, sorted by time. Points
+    received twice are only returned once.
+    """
+    points = {}
+    if archive_path(day).exists():
+        with TrackArchive(archive_path(day)) as archive:
+            for point, source in archive.points():
+                points[(point[0], source)] = (point, source)
+    elif gpx_path(day).exists() and not GpxExport.objects.filter(day=day).exists():
+        # The log was written before points were saved in the database
+        for point, source in read_gpx(gpx_path(day)):
+            points[(point[0], source)] = (point, source)
+
+    start, end = day_range(day)
+    for point_time, latitude, longitude, elevation, source in GpsPoint.objects.filter(
+        time__gte=start, time__lt=end, pk__lte=last_point_id
+    ).values_list("time", "latitude", "longitude", "elevation", "source"):
+        timestamp = int(point_time.timestamp())
+        points[(timestamp, source)] = ((timestamp, latitude, longitude, elevation), source)
+    return sorted(points.values(), key=lambda point: point[0][0])
+
+
+def write_gpx(day: date, points: list[tuple[TrackPoint, str]]):
+    """
+    The old log is replaced once the new one is written, so the timeline never reads a partial file
+    """
+    path = gpx_path(day)
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(render_gpx(points))
+    tmp_path.rename(path)
+
+
+@contextmanager
+def gpx_lock(day: date):
+    """
+    Only one process writes a day's GPX log and archive at a time, even if the exports overlap
+    """
+    lock_path = Path(settings.GPX_LOGS_PATH) / f".{day.strftime('%Y-%m-%d')}.lock"
+    with lock_path.open("w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def get_last_point_id() -> int:
+    """
+    SQLite has a single writer, so every point up to the highest ID is committed. Points received after this are
+    added by the next export.
+    """
+    return GpsPoint.objects.aggregate(Max("id"))["id__max"] or 0
+
+
+def export_gpx(day: date):
+    """
+    Writes the GPX log of a day from the archived points and the points in the database
+    """
+    with gpx_lock(day):
+        last_point_id = get_last_point_id()
+        write_gpx(day, get_day_points(day, last_point_id))
+        GpxExport.objects.update_or_create(day=day, defaults={"last_point_id": last_point_id})
+
+
+def archive_day(day: date) -> int:
+    """
+    Moves the points of a day from the database to the day's archive, and updates the GPX log. Returns the number of
+    archived points.
+    """
+    with gpx_lock(day):
+        last_point_id = get_last_point_id()
+        points = get_day_points(day, last_point_id)
+        write_archive(archive_path(day), points)
+        write_gpx(day, points)
+
+        start, end = day_range(day)
+        with transaction.atomic():
+            GpsPoint.objects.filter(time__gte=start, time__lt=end, pk__lte=last_point_id).delete()
+            GpxExport.objects.update_or_create(day=day, defaults={"last_point_id": last_point_id})
+    return len(points)
+
+
+def is_gpx_outdated(day: date) -> bool:
+    """
+    Whether points were received since the day's GPX log was written
+    """
+    gpx_export = GpxExport.objects.filter(day=day).first()
+    if gpx_export is None or not gpx_path(day).exists():
+        return True
+    start, end = day_range(day)
+    return GpsPoint.objects.filter(time__gte=start, time__lt=end, pk__gt=gpx_export.last_point_id).exists()
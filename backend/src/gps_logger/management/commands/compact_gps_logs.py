@@ -0,0 +1,102 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from gps_logger.archive import TrackArchive, archive_path
+from gps_logger.export import archive_day, day_range, gpx_path, read_gpx
+from gps_logger.models import GpsPoint
+from datetime import date, timedelta
+from pathlib import Path
+import gpxpy.gpx
+import logging
+import os
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+def evict_from_page_cache(path: Path) -> bool:
+    """
+    Removes a file from the OS page cache, so that the next read comes from the disk. Returns False if the OS does not
+    support it.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)  # Only written pages can be evicted
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves the GPS points of past days from the database to compact archives, and archives the GPX logs written "
+        "before points were saved in the database. The GPX logs are kept."
+    )
+
+    def add_arguments(self, parser):
+        # Points can arrive days late, when OwnTracks was offline. They are added to the archive on the next run.
+        parser.add_argument("--keep-days", type=int, default=7, help="Don't archive the last N days")
+
+    def handle(self, *args, **options):
+        first_open_day = (timezone.now() - timedelta(days=max(1, options["keep_days"]))).date()
+
+        days = set(GpsPoint.objects.filter(time__lt=day_range(first_open_day)[0]).dates("time", "day"))
+        for path in Path(settings.GPX_LOGS_PATH).glob("*.gpx"):
+            try:
+                day = date.fromisoformat(path.stem)
+            except ValueError:
+                continue
+            if day < first_open_day and not archive_path(day).exists():
+                days.add(day)
+
+        point_count = gpx_size = archive_size = 0
+        gpx_load_time = archive_load_time = 0
+        is_cold_cache = True
+        archived_days = []
+        for day in sorted(days):
+            # An unreadable GPX log only prevents its own day from being archived
+            try:
+                day_point_count = archive_day(day)
+            except (gpxpy.gpx.GPXException, OSError, ValueError):
+                logger.exception(f"Could not archive {day}")
+                continue
+            logger.info(f"Archived {day_point_count} points from {day}")
+            archived_days.append(day)
+            point_count += day_point_count
+
+            gpx_size += gpx_path(day).stat().st_size
+            archive_size += archive_path(day).stat().st_size
+
+            # Both files were just written. They are read from the disk, so that they are compared fairly.
+            is_cold_cache &= evict_from_page_cache(gpx_path(day)) and evict_from_page_cache(archive_path(day))
+            started_at = time.perf_counter()
+            read_gpx(gpx_path(day))
+            gpx_load_time += time.perf_counter() - started_at
+
+            started_at = time.perf_counter()
+            with TrackArchive(archive_path(day)) as archive:
+                list(archive.points())
+            archive_load_time += time.perf_counter() - started_at
+
+        if not days:
+            self.stdout.write("No days to archive")
+            return
+
+        if failed_day_count := len(days) - len(archived_days):
+            self.stderr.write(f"Could not archive {failed_day_count} days. See the logs for details.")
+        if not archived_days:
+            return
+
+        self.stdout.write(f"Archived {point_count} points from {len(archived_days)} days")
+        self.stdout.write(
+            f"Size: {gpx_size / 1_000_000:.1f} MB as GPX, {archive_size / 1_000_000:.1f} MB archived "
+            f"({gpx_size / max(archive_size, 1):.1f}x smaller)"
+        )
+        self.stdout.write(
+            f"Load time from {'the disk' if is_cold_cache else 'the page cache'}: {gpx_load_time:.2f} s as GPX, "
+            f"{archive_load_time:.2f} s archived ({gpx_load_time / max(archive_load_time, 1e-6):.1f}x faster)"
+        )
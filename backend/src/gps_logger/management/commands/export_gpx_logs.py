@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from gps_logger.archive import archived_days
+from gps_logger.export import export_gpx, is_gpx_outdated
+from gps_logger.models import GpsPoint
+from datetime import timedelta
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# Points can arrive days late, when OwnTracks was offline. Those days are exported again.
+export_lookback = timedelta(days=7)
+
+
+class Command(BaseCommand):
+    help = "Writes the daily GPX logs that are missing points"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all", action="store_true", help="Export every day, including archived days, even if it did not change"
+        )
+
+    def handle(self, *args, **options):
+        points = GpsPoint.objects.all()
+        if not options["all"]:
+            points = points.filter(received_at__gte=timezone.now() - export_lookback)
+
+        days = set(points.dates("time", "day"))
+        if options["all"]:
+            days.update(archived_days())
+
+        for day in sorted(days):
+            if options["all"] or is_gpx_outdated(day):
+                logger.info(f"Exporting GPX log for {day}")
+                export_gpx(day)
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from gps_logger.export import read_gpx
+from gps_logger.models import GpsPoint
+from datetime import datetime, timezone
+from pathlib import Path
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports points from GPX logs into the database, for example logs from another device. Points that are "
+        "already saved are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", type=Path, help="GPX files to import")
+
+    def handle(self, *args, **options):
+        for path in options["paths"]:
+            points = [
+                GpsPoint(
+                    time=datetime.fromtimestamp(timestamp, tz=timezone.utc),
+                    latitude=latitude,
+                    longitude=longitude,
+                    elevation=elevation,
+                    source=source,
+                )
+                for (timestamp, latitude, longitude, elevation), source in read_gpx(path)
+            ]
+            GpsPoint.objects.bulk_create(points, batch_size=1000, ignore_conflicts=True)
+            logger.info(f"Imported {len(points)} points from {path}")
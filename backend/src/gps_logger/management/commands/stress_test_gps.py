@@ -0,0 +1,177 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from gps_logger.export import export_gpx, gpx_path
+from gps_logger.models import GpsPoint
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+import gpxpy
+import json
+import multiprocessing
+import queue
+import statistics
+import tempfile
+import time
+
+
+# The pings start before midnight and end after midnight, so two GPX logs are written
+first_day = date(2024, 1, 1)
+days = (first_day, first_day + timedelta(days=1))
+
+# How often the GPX logs are read while the pings are sent
+gpx_read_interval = 0.1  # Seconds
+
+
+def ping_time(ping: int, ping_count: int) -> int:
+    midnight = datetime.combine(days[1], datetime.min.time(), tzinfo=timezone.utc)
+    return int(midnight.timestamp()) - ping_count // 2 + ping
+
+
+def send_pings(database_path: Path, worker: int, ping_count: int, results: multiprocessing.Queue):
+    """
+    Sends OwnTracks pings like a phone would, one location at a time
+    """
+    connection.close()
+    connection.settings_dict["NAME"] = database_path
+
+    client = Client()
+    latencies = []
+    failure_count = 0
+    for ping in range(ping_count):
+        location = {
+            "_type": "location",
+            "tst": ping_time(ping, ping_count),
+            "lat": 52.5 + worker / 100,
+            "lon": 13.4 + ping / 100000,
+            "alt": 40,
+            "topic": f"owntracks/stress/{worker}",
+        }
+        started_at = time.perf_counter()
+        response = client.post("/api/gps/", json.dumps(location), content_type="application/json")
+        latencies.append(time.perf_counter() - started_at)
+        if response.status_code != 200:
+            failure_count += 1
+    connection.close()
+    results.put((latencies, failure_count))
+
+
+def export_continuously(database_path: Path, stop: multiprocessing.Event):
+    """
+    Exports the GPX logs again and again, like overlapping cron jobs would
+    """
+    connection.close()
+    connection.settings_dict["NAME"] = database_path
+    while not stop.is_set():
+        for day in days:
+            export_gpx(day)
+    connection.close()
+
+
+def read_gpx_points(day: date) -> set[tuple[datetime, str]]:
+    with gpx_path(day).open("r") as gpx_file:
+        gpx = gpxpy.parse(gpx_file)
+    return {
+        (point.time, point.source) for track in gpx.tracks for segment in track.segments for point in segment.points
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Sends GPS pings from many processes at the same time while the GPX logs are exported, and checks that no "
+        "point is lost. Uses a test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=6, help="Number of processes sending pings")
+        parser.add_argument("--pings", type=int, default=200, help="Number of pings per process")
+        parser.add_argument("--exporters", type=int, default=2, help="Number of processes exporting GPX logs")
+
+    def handle(self, *args, **options):
+        processes, ping_count = max(1, options["processes"]), max(1, options["pings"])
+        exporter_count = max(0, options["exporters"])
+
+        with (
+            tempfile.TemporaryDirectory() as tmp_dir,
+            override_settings(GPX_LOGS_PATH=Path(tmp_dir), GPS_ARCHIVE_PATH=Path(tmp_dir) / "archive"),
+        ):
+            database_path = Path(tmp_dir) / "stress-test.db"
+            connection.close()
+            connection.settings_dict["NAME"] = database_path
+            call_command("migrate", verbosity=0)
+
+            # Forked processes must not share the parent's connection
+            connection.close()
+            context = multiprocessing.get_context("fork")
+            results = context.Queue()
+            stop = context.Event()
+            workers = [
+                context.Process(target=send_pings, args=(database_path, worker, ping_count, results))
+                for worker in range(processes)
+            ]
+            exporters = [
+                context.Process(target=export_continuously, args=(database_path, stop)) for _ in range(exporter_count)
+            ]
+            self.stdout.write(
+                f"{processes} processes sending {ping_count} pings each, while {exporter_count} processes export the "
+                f"GPX logs"
+            )
+
+            started_at = time.perf_counter()
+            for process in exporters + workers:
+                process.start()
+
+            # Read the GPX logs while they are written, like the timeline does. The results are collected at the same
+            # time, because a process can't exit before its results are read.
+            read_count = 0
+            read_error_count = 0
+            worker_results = []
+            while len(worker_results) < len(workers):
+                for day in days:
+                    if gpx_path(day).exists():
+                        read_count += 1
+                        try:
+                            read_gpx_points(day)
+                        except:
+                            read_error_count += 1
+                try:
+                    worker_results.append(results.get(timeout=gpx_read_interval))
+                except queue.Empty:
+                    if not any(worker.is_alive() for worker in workers) and results.empty():
+                        stop.set()
+                        raise CommandError("A process stopped without sending its results")
+
+            duration = time.perf_counter() - started_at
+            stop.set()
+            for process in exporters + workers:
+                process.join()
+
+            # The last export adds the points received during the previous exports
+            call_command("export_gpx_logs", verbosity=0)
+            expected_points = {
+                (
+                    datetime.fromtimestamp(ping_time(ping, ping_count), tz=timezone.utc),
+                    f"owntracks/stress/{worker}",
+                )
+                for worker in range(processes)
+                for ping in range(ping_count)
+            }
+            exported_points = set().union(*(read_gpx_points(day) for day in days))
+
+            saved_point_count = GpsPoint.objects.count()
+            connection.close()
+
+        latencies = sorted(latency for worker_latencies, _ in worker_results for latency in worker_latencies)
+        failure_count = sum(failures for _, failures in worker_results)
+        missing_count = len(expected_points - exported_points)
+        self.stdout.write(
+            f"{len(latencies) / duration:.0f} pings/s, "
+            f"p50 {statistics.median(latencies) * 1000:.1f} ms, "
+            f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms, "
+            f"{failure_count} failed pings"
+        )
+        self.stdout.write(f"{saved_point_count} of {len(expected_points)} points saved in the database")
+        self.stdout.write(f"{len(exported_points)} points exported, {missing_count} missing from the GPX logs")
+        self.stdout.write(f"{read_count} GPX logs read during the test, {read_error_count} could not be parsed")
+        if failure_count or missing_count or read_error_count or saved_point_count != len(expected_points):
+            raise CommandError("Points were lost")
@@ -0,0 +1,28 @@
+# Generated by Django 6.0.5 on 2026-10-18 19:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="GpsPoint",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("time", models.DateTimeField()),
+                ("latitude", models.FloatField()),
+                ("longitude", models.FloatField()),
+                ("elevation", models.IntegerField(null=True)),
+                ("accuracy", models.IntegerField(null=True)),
+                ("source", models.CharField(blank=True, max_length=100)),
+                ("received_at", models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                "constraints": [models.UniqueConstraint(fields=("time", "source"), name="unique_gps_point")],
+            },
+        ),
+    ]
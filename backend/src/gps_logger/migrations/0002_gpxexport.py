@@ -0,0 +1,20 @@
+# Generated by Django 6.0.5 on 2026-10-18 19:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("gps_logger", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GpxExport",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("day", models.DateField(unique=True)),
+                ("last_point_id", models.BigIntegerField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 6.0.5 on 2026-10-18 20:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("gps_logger", "0002_gpxexport"),
+    ]
+
+    operations = [
+        # Spatial index for bounding box queries. The triggers keep it in sync with the points table. Points are never
+        # updated.
+        migrations.RunSQL(
+            sql=[
+                "CREATE VIRTUAL TABLE gps_logger_gpspoint_rtree "
+                "USING rtree(id, min_latitude, max_latitude, min_longitude, max_longitude)",
+                "INSERT INTO gps_logger_gpspoint_rtree "
+                "SELECT id, latitude, latitude, longitude, longitude FROM gps_logger_gpspoint",
+                "CREATE TRIGGER gps_logger_gpspoint_rtree_insert AFTER INSERT ON gps_logger_gpspoint BEGIN "
+                "INSERT INTO gps_logger_gpspoint_rtree "
+                "VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude); "
+                "END",
+                "CREATE TRIGGER gps_logger_gpspoint_rtree_delete AFTER DELETE ON gps_logger_gpspoint BEGIN "
+                "DELETE FROM gps_logger_gpspoint_rtree WHERE id = old.id; "
+                "END",
+            ],
+            reverse_sql=[
+                "DROP TRIGGER gps_logger_gpspoint_rtree_delete",
+                "DROP TRIGGER gps_logger_gpspoint_rtree_insert",
+                "DROP TABLE gps_logger_gpspoint_rtree",
+            ],
+        ),
+    ]
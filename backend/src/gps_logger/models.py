@@ -0,0 +1,30 @@
+from django.db import models
+
+
+class GpsPoint(models.Model):
+    """
+    A position received from OwnTracks. Points are only ever added. The daily GPX files are exported from them.
+    """
+
+    time = models.DateTimeField()
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    elevation = models.IntegerField(null=True)
+    accuracy = models.IntegerField(null=True)  # Available but unused
+    source = models.CharField(max_length=100, blank=True)
+    received_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            # OwnTracks sends the same point again if it did not get a response
+            models.UniqueConstraint(fields=["time", "source"], name="unique_gps_point"),
+        ]
+
+
+class GpxExport(models.Model):
+    """
+    The last point that was received when a day's GPX log was written. Points with a higher ID are missing from it.
+    """
+
+    day = models.DateField(unique=True)
+    last_point_id = models.BigIntegerField()
@@ -0,0 +1,165 @@
+import heapq
+import math
+from datetime import datetime
+from typing import Iterable, Iterator
+
+from django.db.models.expressions import RawSQL
+
+from .archive import TrackArchive, TrackPoint, archive_path, archived_days
+from .models import GpsPoint
+
+earth_radius = 6_371_000  # Meters
+
+
+def get_points(
+    start: datetime | None = None,
+    end: datetime | None = None,
+    bbox: tuple[float, float, float, float] | None = None,  # min longitude, min latitude, max longitude, max latitude
+    source: str | None = None,
+) -> Iterator[TrackPoint]:
+    """
+    Returns the logged points in chronological order, from the archives and from the database
+    """
+    return heapq.merge(
+        get_archived_points(start, end, bbox, source),
+        get_database_points(start, end, bbox, source),
+        key=lambda point: point[0],
+    )
+
+
+def get_archived_points(
+    start: datetime | None,
+    end: datetime | None,
+    bbox: tuple[float, float, float, float] | None,
+    source: str | None,
+) -> Iterator[TrackPoint]:
+    start_timestamp = start.timestamp() if start else 0
+    end_timestamp = end.timestamp() if end else math.inf
+    for day in archived_days():
+        if (start and day < start.date()) or (end and day > end.date()):
+            continue
+        with TrackArchive(archive_path(day)) as archive:
+            if bbox:
+                min_longitude, min_latitude, max_longitude, max_latitude = bbox
+                archive_min_latitude, archive_min_longitude, archive_max_latitude, archive_max_longitude = archive.bbox
+                if (
+                    archive_max_latitude < min_latitude
+                    or archive_min_latitude > max_latitude
+                    or archive_max_longitude < min_longitude
+                    or archive_min_longitude > max_longitude
+                ):
+                    continue
+            if source and source not in archive.sources:
+                continue
+
+            for point, point_source in archive.points():
+                timestamp, latitude, longitude, elevation = point
+                if not (start_timestamp <= timestamp < end_timestamp):
+                    continue
+                if bbox and not (
+                    min_latitude <= latitude <= max_latitude and min_longitude <= longitude <= max_longitude
+                ):
+                    continue
+                if source and point_source != source:
+                    continue
+                yield point
+
+
+def get_database_points(
+    start: datetime | None,
+    end: datetime | None,
+    bbox: tuple[float, float, float, float] | None,
+    source: str | None,
+) -> Iterator[TrackPoint]:
+    points = GpsPoint.objects.order_by("time")
+    if start:
+        points = points.filter(time__gte=start)
+    if end:
+        points = points.filter(time__lt=end)
+    if source:
+        points = points.filter(source=source)
+    if bbox:
+        min_longitude, min_latitude, max_longitude, max_latitude = bbox
+        # The R*Tree index stores rounded coordinates, so the exact bounds are checked again
+        points = points.filter(
+            pk__in=RawSQL(
+                "SELECT id FROM gps_logger_gpspoint_rtree "
+                "WHERE max_latitude >= %s AND min_latitude <= %s AND max_longitude >= %s AND min_longitude <= %s",
+                (min_latitude, max_latitude, min_longitude, max_longitude),
+            ),
+            latitude__range=(min_latitude, max_latitude),
+            longitude__range=(min_longitude, max_longitude),
+        )
+
+    for time, latitude, longitude, elevation in points.values_list(
+        "time", "latitude", "longitude", "elevation"
+    ).iterator(chunk_size=10_000):
+        yield int(time.timestamp()), latitude, longitude, elevation
+
+
+def bucket_by_time(points: Iterable[TrackPoint], interval: int) -> Iterator[TrackPoint]:
+    """
+    Keeps the first point of every `interval` seconds
+    """
+    last_bucket = None
+    for point in points:
+        bucket = point[0] // interval
+        if bucket != last_bucket:
+            last_bucket = bucket
+            yield point
+
+
+def distance_to_segment(point: tuple[float, float], start: tuple[float, float], end: tuple[float, float]) -> float:
+    segment_x, segment_y = end[0] - start[0], end[1] - start[1]
+    segment_length_squared = segment_x**2 + segment_y**2
+    if segment_length_squared == 0:
+        return math.dist(point, start)
+    position = ((point[0] - start[0]) * segment_x + (point[1] - start[1]) * segment_y) / segment_length_squared
+    position = min(1, max(0, position))
+    return math.dist(point, (start[0] + position * segment_x, start[1] + position * segment_y))
+
+
+def simplify(points: list[TrackPoint], tolerance: float) -> list[TrackPoint]:
+    """
+    Removes the points that are less than `tolerance` meters away from the simplified track (Douglas-Peucker)
+    """
+    if len(points) < 3:
+        return points
+
+    # Approximate position in meters. It's precise enough to simplify a track.
+    coordinates = [
+        (
+            math.radians(longitude) * math.cos(math.radians(latitude)) * earth_radius,
+            math.radians(latitude) * earth_radius,
+        )
+        for timestamp, latitude, longitude, elevation in points
+    ]
+
+    # Drop the points that are too close to the previous point first. It's much faster than Douglas-Peucker, and
+    # most points are close together when moving slowly.
+    distant_indexes = []
+    previous = coordinates[0]
+    for index in range(1, len(points) - 1):
+        if math.dist(coordinates[index], previous) < tolerance:
+            continue
+        distant_indexes.append(index)
+        previous = coordinates[index]
+    indexes = [0, *distant_indexes, len(points) - 1]
+
+    kept = [False] * len(indexes)
+    kept[0] = kept[-1] = True
+    ranges = [(0, len(indexes) - 1)]
+    while ranges:
+        first, last = ranges.pop()
+        farthest_index, farthest_distance = None, tolerance
+        for index in range(first + 1, last):
+            distance = distance_to_segment(
+                coordinates[indexes[index]], coordinates[indexes[first]], coordinates[indexes[last]]
+            )
+            if distance > farthest_distance:
+                farthest_index, farthest_distance = index, distance
+        if farthest_index is not None:
+            kept[farthest_index] = True
+            ranges.append((first, farthest_index))
+            ranges.append((farthest_index, last))
+    return [points[index] for index, is_kept in zip(indexes, kept) if is_kept]
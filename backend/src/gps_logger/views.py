@@ -1,70 +1,187 @@
-from datetime import datetime
-from decimal import Decimal
-from django.conf import settings
+from datetime import datetime, timezone
+from django.db import transaction
 from django.http import JsonResponse
 from django.views import View
-from pathlib import Path
-import gpxpy
+from .archive import TrackArchive, archive_path
+from .models import GpsPoint
+from .tracks import bucket_by_time, get_points, simplify
+import itertools
 import json
 import logging
 
 
 logger = logging.getLogger(__name__)
 
+# Enough to draw a detailed map. Larger tracks must be downsampled.
+max_track_points = 100_000
+# Simplified tracks are loaded in memory first. Longer tracks must be downsampled with the interval parameter first.
+max_simplified_points = 500_000
 
-def log_position(
-    time: datetime,
-    latitude: Decimal,
-    longitude: Decimal,
-    elevation: int,
-    accuracy: int,  # Available but unused
-    source: str,
-):
-    point = gpxpy.gpx.GPXTrackPoint(
-        latitude=latitude,
-        longitude=longitude,
-        elevation=elevation,
-        time=time,
+
+def parse_coordinate(value, limit: float) -> float:
+    coordinate = float(value)
+    if not -limit <= coordinate <= limit:  # Also false for NaN
+        raise ValueError(f"{value} is not a valid coordinate")
+    return coordinate
+
+
+def parse_optional_integer(value) -> int | None:
+    if value is None:
+        return None
+    integer = round(float(value))
+    if not -(2**31) <= integer < 2**31:  # Must fit in an IntegerField
+        raise ValueError(f"{value} is out of range")
+    return integer
+
+
+def parse_location(data: dict) -> GpsPoint:
+    """
+    Creates a point from an OwnTracks location message. Raises KeyError, TypeError, ValueError, OverflowError or
+    OSError if the message is invalid. The values are checked here, so that an invalid message can't make saving the
+    other messages fail.
+    """
+    return GpsPoint(
+        time=datetime.fromtimestamp(int(data["tst"]), tz=timezone.utc),
+        latitude=parse_coordinate(data["lat"], 90),
+        longitude=parse_coordinate(data["lon"], 180),
+        elevation=parse_optional_integer(data.get("alt")),
+        accuracy=parse_optional_integer(data.get("acc")),
+        source=str(data.get("topic", "")),
     )
-    point.source = source
 
-    gpx_path = Path(settings.GPX_LOGS_PATH) / f"{time.strftime('%Y-%m-%d')}.gpx"
 
-    # Create or append
-    try:
-        with gpx_path.open("r") as gpx_file:
-            gpx = gpxpy.parse(gpx_file)
-    except:
-        gpx = gpxpy.gpx.GPX()
-        gpx.tracks.append(gpxpy.gpx.GPXTrack())
-        gpx.tracks[-1].segments.append(gpxpy.gpx.GPXTrackSegment())
+def drop_archived_points(points: list[GpsPoint]) -> list[GpsPoint]:
+    """
+    Removes the points that are already in their day's archive. Archived points are not in the database anymore, so
+    the unique constraint does not skip them when they are received again.
+    """
+    archived_points = set()
+    for day in {point.time.date() for point in points}:  # The archives are split by UTC day, like the points' times
+        if archive_path(day).exists():
+            with TrackArchive(archive_path(day)) as archive:
+                archived_points.update((point[0], source) for point, source in archive.points())
+    return [point for point in points if (int(point.time.timestamp()), point.source) not in archived_points]
 
-    gpx.tracks[-1].segments[-1].points.append(point)
 
-    with gpx_path.open("w") as gpx_file:
-        gpx_file.write(gpx.to_xml())
+@transaction.atomic
+def log_positions(points: list[GpsPoint]) -> int:
+    """
+    Saves positions in a single transaction. It takes the same time however many points were logged that day. The GPX
+    logs are exported from the database every few minutes. Returns the number of new points.
+    """
+    points = drop_archived_points(points)
+    if not points:
+        return 0
+
+    # Points that were already received are skipped. Count them to report how many points are new.
+    time_range = (min(point.time for point in points), max(point.time for point in points))
+    count_before = GpsPoint.objects.filter(time__range=time_range).count()
+    GpsPoint.objects.bulk_create(points, batch_size=500, ignore_conflicts=True)
+    return GpsPoint.objects.filter(time__range=time_range).count() - count_before
 
 
 class GpsLoggerView(View):
     """
-    Receives HTTP pings from OwnTracks
+    Receives HTTP pings from OwnTracks. A ping can contain a single message, or a list of messages when OwnTracks sends
+    the messages it queued while it was offline.
     """
 
     def post(self, request, *args, **kwargs):
         try:
             data = json.loads(request.body)
-            if data["_type"] == "location":
-                log_position(
-                    time=datetime.utcfromtimestamp(data["tst"]),
-                    latitude=Decimal(data["lat"]),
-                    longitude=Decimal(data["lon"]),
-                    elevation=data.get("alt"),
-                    accuracy=data.get("acc"),
-                    source=data.get("topic", ""),
-                )
-            return JsonResponse({"status": "ok"})
+            messages = data if isinstance(data, list) else [data]
+
+            points = []
+            ignored_count = 0
+            for message in messages:
+                # Transitions, waypoints, last will messages, etc. are accepted but not logged
+                if not isinstance(message, dict) or message.get("_type") != "location":
+                    ignored_count += 1
+                    continue
+
+                try:
+                    points.append(parse_location(message))
+                except (KeyError, TypeError, ValueError, OverflowError, OSError):
+                    logger.warning(f"Ignoring invalid location message: {message}")
+                    ignored_count += 1
+
+            ingested_count = log_positions(points)
+            if len(messages) > 1:
+                logger.info(f"Logged {ingested_count} new points from {len(messages)} messages")
+            return JsonResponse(
+                {
+                    "status": "ok",
+                    "ingested": ingested_count,
+                    "duplicates": len(points) - ingested_count,
+                    "ignored": ignored_count,
+                }
+            )
         except json.JSONDecodeError:
             return JsonResponse({"status": "failure", "message": "Invalid JSON"}, status=400)
         except Exception as e:
             logger.exception("Error while logging geolocation")
             return JsonResponse({"status": "failure", "message": str(e)}, status=500)
+
+
+class GpsTrackView(View):
+    """
+    Returns the points logged between two times and/or within a bounding box, as [timestamp, lat, lon, elevation] lists.
+
+    Parameters:
+    - start, end: Unix timestamps
+    - bbox: min longitude, min latitude, max longitude, max latitude
+    - source: OwnTracks topic of the device
+    - interval: keep one point every `interval` seconds
+    - simplify: remove the points that are less than `simplify` meters from the simplified track
+    """
+
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_superuser:
+            return JsonResponse(
+                {"status": "failure", "message": "You do not have the permission to access this feature"}, status=403
+            )
+
+        try:
+            start, end = (
+                datetime.fromtimestamp(int(request.GET[param]), tz=timezone.utc) if request.GET.get(param) else None
+                for param in ("start", "end")
+            )
+            bbox = None
+            if request.GET.get("bbox"):
+                bbox = tuple(float(value) for value in request.GET["bbox"].split(","))
+                if len(bbox) != 4:
+                    raise ValueError("bbox must have 4 values")
+            interval = int(request.GET.get("interval", 0))
+            tolerance = float(request.GET.get("simplify", 0))
+            if interval < 0 or tolerance < 0:
+                raise ValueError("interval and simplify must be positive")
+        except (ValueError, OverflowError) as e:
+            return JsonResponse({"status": "failure", "message": f"Invalid parameters: {e}"}, status=400)
+
+        points = get_points(start, end, bbox, request.GET.get("source"))
+        if interval:
+            points = bucket_by_time(points, interval)
+
+        # Stop reading as soon as there are too many points, instead of reading the whole time range
+        point_limit = max_simplified_points if tolerance else max_track_points
+        points = list(itertools.islice(points, point_limit + 1))
+        if len(points) > point_limit:
+            return JsonResponse(
+                {
+                    "status": "failure",
+                    "message": f"More than {point_limit} points. Use a shorter time range, or the interval parameter.",
+                },
+                status=400,
+            )
+
+        if tolerance:
+            points = simplify(points, tolerance)
+            if len(points) > max_track_points:
+                return JsonResponse(
+                    {
+                        "status": "failure",
+                        "message": f"Too many points ({len(points)}). Use a larger simplify or interval parameter.",
+                    },
+                    status=400,
+                )
+        return JsonResponse({"status": "ok", "count": len(points), "points": points})
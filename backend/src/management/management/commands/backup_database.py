@@ -1,38 +1,84 @@
-from datetime import datetime
-from dateutil.relativedelta import relativedelta
+from datetime import datetime, timedelta
 from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import connection
 from django.utils import timezone
-from shutil import copy
+from pathlib import Path
+import gzip
 import logging
+import shutil
+import sqlite3
+import time
 
 
 logger = logging.getLogger(__name__)
 
+# The database is copied a few pages at a time, so that writers are not blocked for the whole backup
+backup_pages_per_step = 1024
+backup_step_pause = 0.01  # Seconds
+
 
 class Command(BaseCommand):
-    help = "Creates dated database backups, deletes old backups"
+    help = "Creates dated, compressed database backups, deletes old backups"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--keep-days",
+            type=int,
+            default=settings.DATABASE_BACKUP_RETENTION_DAYS,
+            help="Delete backups older than this many days",
+        )
 
     def handle(self, *args, **options):
         try:
             settings.DATABASE_BACKUPS_PATH.mkdir(parents=True, exist_ok=True)
-            backup_file = settings.DATABASE_BACKUPS_PATH / (timezone.now().strftime("%Y-%m-%d") + ".db")
+            backup_file = settings.DATABASE_BACKUPS_PATH / (timezone.now().strftime("%Y-%m-%d") + ".db.gz")
             logger.info(f"Backing up database to {str(backup_file)}")
-            copy(settings.DATABASE_PATH, backup_file)
-
-            one_month_ago = datetime.now() - relativedelta(months=1)
-            for file in settings.DATABASE_BACKUPS_PATH.iterdir():
-                if file.is_file():
-                    try:
-                        file_date = timezone.make_aware(
-                            datetime.strptime(file.stem, "%Y-%m-%d"), timezone.get_current_timezone()
-                        )
-                        if file_date.date() < one_month_ago.date():
-                            logger.info(f"Removing old database backup at {str(file)}")
-                            file.unlink()
-                    except ValueError:
-                        pass
+            started_at = time.monotonic()
+            database_size = self.backup_database(backup_file)
+            logger.info(
+                f"Backed up {database_size / 1_000_000:.1f} MB database to {backup_file.name} "
+                f"({backup_file.stat().st_size / 1_000_000:.1f} MB) in {time.monotonic() - started_at:.1f} seconds"
+            )
+            self.delete_old_backups(options["keep_days"])
         except Exception:
             logger.exception("Database backup failed")
         else:
             logger.info("Database backup complete")
+
+    def backup_database(self, backup_file: Path) -> int:
+        """
+        Makes a consistent copy of the live database with SQLite's online backup API, then compresses it.
+        Returns the size of the uncompressed copy.
+        """
+        tmp_file = backup_file.with_name(backup_file.name + ".tmp")
+        uncompressed_file = backup_file.with_suffix("")  # .db
+        try:
+            connection.ensure_connection()
+            target = sqlite3.connect(uncompressed_file)
+            try:
+                connection.connection.backup(target, pages=backup_pages_per_step, sleep=backup_step_pause)
+            finally:
+                target.close()
+            database_size = uncompressed_file.stat().st_size
+
+            with uncompressed_file.open("rb") as source_file, gzip.open(tmp_file, "wb") as compressed_file:
+                shutil.copyfileobj(source_file, compressed_file)
+            tmp_file.rename(backup_file)
+            return database_size
+        finally:
+            uncompressed_file.unlink(missing_ok=True)
+            tmp_file.unlink(missing_ok=True)
+
+    def delete_old_backups(self, keep_days: int):
+        oldest_date = timezone.localdate() - timedelta(days=keep_days)
+        for file in settings.DATABASE_BACKUPS_PATH.iterdir():
+            if not file.is_file():
+                continue
+            try:
+                file_date = datetime.strptime(file.name.split(".")[0], "%Y-%m-%d").date()
+            except ValueError:
+                continue
+            if file_date < oldest_date:
+                logger.info(f"Removing old database backup at {str(file)}")
+                file.unlink()
@@ -0,0 +1,73 @@
+from base64 import b64encode
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from pathlib import Path
+import secrets
+import statistics
+import tempfile
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures how long Caddy waits for /auth/verify/, with and without the verification cache. Uses a test "
+        "database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=50, help="Number of requests per scenario")
+
+    def handle(self, *args, **options):
+        request_count = max(1, options["requests"])
+        with (
+            tempfile.TemporaryDirectory() as tmp_dir,
+            override_settings(
+                CACHES={"default": {**settings.CACHES["default"], "LOCATION": str(Path(tmp_dir) / "cache")}}
+            ),
+        ):
+            # The benchmark user and its password only exist in the test database
+            connection.close()
+            connection.settings_dict["NAME"] = Path(tmp_dir) / "benchmark.db"
+            call_command("migrate", verbosity=0)
+
+            password = secrets.token_urlsafe()
+            user = User.objects.create_superuser("benchmark", password=password)
+            session_client = Client()
+            session_client.force_login(user)
+            basic_auth_header = "Basic " + b64encode(f"{user.username}:{password}".encode("utf-8")).decode("ascii")
+
+            scenarios = (
+                ("Movie chunk", Client(), "/movies/Movie/Movie.mp4", {}),
+                ("Session", session_client, "/api/movies/", {}),
+                ("Superuser", session_client, "/files/", {}),
+                ("Basic auth", Client(), "/api/gps/", {"HTTP_AUTHORIZATION": basic_auth_header}),
+            )
+
+            self.stdout.write(f"{request_count} requests per scenario, milliseconds per request")
+            self.stdout.write(f"{'Scenario':<12} {'Cache':<9} {'p50 ms':>8} {'p95 ms':>8} {'Max ms':>8}")
+            for name, client, url, headers in scenarios:
+                for use_cache in (False, True):
+                    latencies = []
+                    for _ in range(request_count):
+                        if not use_cache:
+                            cache.clear()
+                        started_at = time.perf_counter()
+                        response = client.get("/auth/verify/", HTTP_X_FORWARDED_URI=url, **headers)
+                        latencies.append(time.perf_counter() - started_at)
+                        assert response.status_code == 200, f"{name} request was not allowed"
+
+                    latencies.sort()
+                    self.stdout.write(
+                        f"{name:<12} "
+                        f"{'cached' if use_cache else 'uncached':<9} "
+                        f"{statistics.median(latencies) * 1000:>8.2f} "
+                        f"{latencies[int(len(latencies) * 0.95)] * 1000:>8.2f} "
+                        f"{latencies[-1] * 1000:>8.2f}"
+                    )
+            session_client.logout()
+            connection.close()
@@ -0,0 +1,97 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, transaction
+from django.utils import timezone
+from pathlib import Path
+import multiprocessing
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+
+row_count = 100
+
+# The database settings before they were tuned
+default_options = {"timeout": 20}
+
+
+def update_progress(database_path: Path, options: dict, update_count: int, results: multiprocessing.Queue):
+    """
+    Updates random rows like EpisodeProgressView does: read the row, then write it in the same transaction
+    """
+    connection.close()
+    connection.settings_dict.update({"NAME": database_path, "OPTIONS": options})
+
+    latencies = []
+    error_count = 0
+    for _ in range(update_count):
+        row_id = random.randint(1, row_count)
+        started_at = time.perf_counter()
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute("SELECT stopped_at FROM progress WHERE id = %s", [row_id])
+                stopped_at = cursor.fetchone()[0]
+                cursor.execute(
+                    "UPDATE progress SET stopped_at = %s, updated_at = %s WHERE id = %s",
+                    [stopped_at + 1, timezone.now().isoformat(), row_id],
+                )
+        except OperationalError:  # Database is locked
+            error_count += 1
+        latencies.append(time.perf_counter() - started_at)
+    connection.close()
+    results.put((latencies, error_count))
+
+
+class Command(BaseCommand):
+    help = "Measures how the database handles many processes updating the watch progress at the same time"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=6, help="Number of processes writing at the same time")
+        parser.add_argument("--updates", type=int, default=200, help="Number of updates per process")
+
+    def handle(self, *args, **options):
+        processes, updates = max(1, options["processes"]), max(1, options["updates"])
+        self.stdout.write(f"{processes} processes making {updates} progress updates each, in a test database")
+        self.stdout.write(f"{'Settings':<10} {'Updates/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'Max ms':>8} {'Errors':>7}")
+
+        configurations = (
+            ("default", "DELETE", default_options),
+            ("tuned", "WAL", settings.DATABASES["default"]["OPTIONS"]),
+        )
+        for name, journal_mode, database_options in configurations:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                database_path = Path(tmp_dir) / "benchmark.db"
+                with sqlite3.connect(database_path) as db:
+                    db.execute(f"PRAGMA journal_mode={journal_mode}")
+                    db.execute("CREATE TABLE progress (id INTEGER PRIMARY KEY, stopped_at INTEGER, updated_at TEXT)")
+                    db.executemany("INSERT INTO progress VALUES (?, 0, '')", [(i,) for i in range(1, row_count + 1)])
+                db.close()
+
+                # Forked processes must not share the parent's connection
+                connection.close()
+                context = multiprocessing.get_context("fork")
+                results = context.Queue()
+                workers = [
+                    context.Process(target=update_progress, args=(database_path, database_options, updates, results))
+                    for _ in range(processes)
+                ]
+                started_at = time.perf_counter()
+                for worker in workers:
+                    worker.start()
+                worker_results = [results.get() for _ in workers]
+                duration = time.perf_counter() - started_at
+                for worker in workers:
+                    worker.join()
+
+            latencies = sorted(latency for worker_latencies, _ in worker_results for latency in worker_latencies)
+            error_count = sum(errors for _, errors in worker_results)
+            self.stdout.write(
+                f"{name:<10} "
+                f"{(len(latencies) - error_count) / duration:>10.0f} "
+                f"{statistics.median(latencies) * 1000:>8.1f} "
+                f"{latencies[int(len(latencies) * 0.95)] * 1000:>8.1f} "
+                f"{latencies[-1] * 1000:>8.1f} "
+                f"{error_count:>7}"
+            )
@@ -1,10 +1,18 @@
 from django.contrib import admin
-from .models import Episode, EpisodeWatchStatus, IgnoredTriageFile, StarredMovie
+from .models import (
+    ConversionJob,
+    CoverDownload,
+    Episode,
+    EpisodeWatchStatus,
+    IgnoredTriageFile,
+    StarredMovie,
+    VideoProbe,
+)
 
 
 @admin.register(Episode)
 class EpisodeAdmin(admin.ModelAdmin):
-    list_display = ("title", "season", "episode", "date_added", "conversion_status")
+    list_display = ("title", "season", "episode", "date_added", "duration", "conversion_status")
 
 
 @admin.register(EpisodeWatchStatus)
@@ -20,3 +28,48 @@ class StarredMovieAdmin(admin.ModelAdmin):
 @admin.register(IgnoredTriageFile)
 class IgnoredTriageFileAdmin(admin.ModelAdmin):
     list_display = ("path",)
+
+
+@admin.register(ConversionJob)
+class ConversionJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "episode",
+        "state",
+        "plan",
+        "priority",
+        "attempts",
+        "worker",
+        "progress",
+        "speed",
+        "created_at",
+        "started_at",
+        "finished_at",
+    )
+    list_filter = ("state", "plan")
+
+
+@admin.register(VideoProbe)
+class VideoProbeAdmin(admin.ModelAdmin):
+    list_display = ("path", "format", "duration", "video_codec", "audio_codecs", "probed_at")
+    search_fields = ("path",)
+
+    @admin.display()
+    def format(self, obj):
+        return obj.metadata["format"]
+
+    @admin.display()
+    def duration(self, obj):
+        return obj.metadata["duration"]
+
+    @admin.display()
+    def video_codec(self, obj):
+        return ", ".join(s["codec_name"] for s in obj.metadata["video_streams"])
+
+    @admin.display()
+    def audio_codecs(self, obj):
+        return ", ".join(s["codec_name"] for s in obj.metadata["audio_streams"])
+
+
+@admin.register(CoverDownload)
+class CoverDownloadAdmin(admin.ModelAdmin):
+    list_display = ("tmdb_id", "url", "attempts", "next_attempt_at")
@@ -1,10 +1,22 @@
-from collections.abc import Iterable
+from collections.abc import Callable, Iterator
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass
 from decimal import Decimal
 from pathlib import Path
 from typing import Any
+from urllib.parse import quote
+import csv
+import fcntl
 import json
 import logging
+import os
+import re
+import shutil
 import subprocess
+import tempfile
+
+from .models import VideoProbe
 
 
 logger = logging.getLogger(__name__)
@@ -13,75 +25,168 @@ ffmpeg_path = "/usr/bin/ffmpeg"
 subtitle_languages = ("eng", "fre", "ger")  # ISO 639-2/B language codes
 max_video_bitrate = 8_000_000
 max_video_height = 1080
+# Conversion plans, from cheapest to most expensive
+REMUX = "remux"  # Only change the container
+TRANSCODE_AUDIO = "audio"  # Copy the video, convert the audio
+TRANSCODE_VIDEO = "video"  # Convert the video, copy the audio
+FULL_TRANSCODE = "full"  # Convert the video and the audio
 
+hls_renditions = ((1080, 8_000_000), (720, 4_000_000), (480, 1_500_000))  # Height, max video bitrate
+hls_segment_duration = 6  # Seconds
 
-def get_videos_to_process(input_dir: Path) -> Iterable[Path]:
-    return [
-        path
-        for path in input_dir.iterdir()
-        if path.is_file()
-        and path.stem.endswith(".original")
-        and not path.with_name(path.stem.removesuffix(".original") + ".converted.mp4").exists()
-    ]
+# Long conversions are split into segments that are converted in parallel. Converted segments survive restarts.
+conversion_segment_duration = 300  # Seconds
+segment_conversion_threads = 2  # Minimum CPU threads per segment
+segmented_video_share = 0.9  # Share of the conversion's progress for the video segments. The rest is for the final mux.
 
 
-def get_subtitles_to_convert(input_dir: Path) -> Iterable[Path]:
+@dataclass
+class ConversionProgress:
+    out_time: float  # Seconds of video converted so far
+    fps: float
+    speed: float  # Seconds of video converted per second
+
+
+def run_ffmpeg(ffmpeg_params: list[str], on_progress: Callable[[ConversionProgress], None] | None = None):
     """
-    User-uploaded .srt subtitles that don't have matching .vtt subtitles
+    Runs ffmpeg and calls on_progress with its progress about twice per second. Raises CalledProcessError with
+    ffmpeg's stderr output if it fails.
     """
-    return [
-        path
-        for path in input_dir.iterdir()
-        if path.is_file() and path.suffix == ".srt" and not path.with_suffix(".vtt").exists()
-    ]
+    ffmpeg_params = [ffmpeg_params[0], "-progress", "pipe:1", "-nostats", *ffmpeg_params[1:]]
+
+    # stderr goes to a file, so that a full stderr pipe can't block ffmpeg while we read its progress
+    with tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(ffmpeg_params, stdout=subprocess.PIPE, stderr=stderr_file)
+        progress = {}
+        for line in process.stdout:
+            key, _, value = line.decode("utf-8", errors="replace").strip().partition("=")
+            progress[key] = value
+            if key == "progress":  # Last line of a progress block
+                if on_progress:
+                    on_progress(
+                        ConversionProgress(
+                            out_time=max(0, parse_progress_value(progress.get("out_time_us"))) / 1_000_000,
+                            fps=parse_progress_value(progress.get("fps")),
+                            speed=parse_progress_value(progress.get("speed", "").removesuffix("x")),
+                        )
+                    )
+                progress = {}
+
+        if return_code := process.wait():
+            stderr_file.seek(0)
+            raise subprocess.CalledProcessError(return_code, ffmpeg_params, stderr=stderr_file.read())
+
+
+def parse_progress_value(value: str | None) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):  # Missing, or "N/A" at the start of a conversion
+        return 0
 
 
-def convert_for_streaming(input_file: Path, output_file: Path):
+@contextmanager
+def lock_video(input_file: Path) -> Iterator[bool]:
+    """
+    Lock an original video so that only one worker converts it. Yields False if another worker has the lock.
+
+    The lock is held with flock() on a .lock file next to the video, so it is released if the worker crashes.
+    """
+    lock_file = input_file.with_name(input_file.stem.removesuffix(".original") + ".lock")
+    fd = os.open(lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+
+        # Another worker might have deleted the lock file after we opened it, and created a new one
+        try:
+            is_same_file = os.stat(lock_file).st_ino == os.fstat(fd).st_ino
+        except FileNotFoundError:
+            is_same_file = False
+        if not is_same_file:
+            yield False
+            return
+
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        try:
+            yield True
+        finally:
+            lock_file.unlink(missing_ok=True)
+    finally:
+        os.close(fd)
+
+
+def convert_for_streaming(
+    input_file: Path,
+    output_file: Path,
+    subtitle_file_template: str | None = None,
+    threads: int = 0,
+    metadata: dict[str, Any] | None = None,
+    on_progress: Callable[[ConversionProgress], None] | None = None,
+    encoded_video: Path | None = None,
+):
+    """
+    Converts a video to a streamable .mp4 file. If subtitle_file_template is set, the subtitles are also extracted to
+    .srt and .vtt files by the same ffmpeg process, so the input file is only read once.
+
+    If encoded_video is set, the video stream is copied from that concat list of converted segments, and only the
+    other streams are taken from input_file.
+    """
     output_file.unlink(missing_ok=True)
 
-    metadata = get_video_metadata(input_file)
+    metadata = metadata or get_video_metadata(input_file)
+    subtitle_params = get_subtitle_output_params(input_file, subtitle_file_template, metadata)
 
     ffmpeg_params = [
         ffmpeg_path,
-        "-i",
-        str(input_file),
-        "-preset",  # Slower conversion, smaller output file
-        "slow",
-        "-threads",  # Multithreading
-        "0",
         "-loglevel",  # Suppress warnings and info
         "error",
         "-y",  # Don't ask for user input
-        "-f",  # Use mp4 container
-        "mp4",
     ]
+    if subtitle_params:
+        ffmpeg_params.append("-fix_sub_duration")
+    if encoded_video:
+        # The converted segments start at 0, but the original's streams keep their own timestamps. The original's
+        # streams are shifted so that its video would also start at 0, and the audio and subtitles stay in sync.
+        video_start_time = float(metadata["video_streams"][0].get("start_time") or 0)
+        ffmpeg_params.extend(["-copyts", "-itsoffset", str(-video_start_time)])
+    ffmpeg_params.extend(["-i", str(input_file)])
+    if encoded_video:
+        ffmpeg_params.extend(["-f", "concat", "-safe", "0", "-i", str(encoded_video)])
+
+    # Output 1: streamable video
+    ffmpeg_params.extend(
+        [
+            "-preset",  # Slower conversion, smaller output file
+            "slow",
+            "-threads",  # Multithreading. 0 uses all cores.
+            str(threads),
+            "-f",  # Use mp4 container
+            "mp4",
+        ]
+    )
 
     ffmpeg_params.extend(["-map", "0:a"])  # Audio: map all streams
-    ffmpeg_params.extend(["-map", "0:v:0"])  # Video: only map one stream
+    ffmpeg_params.extend(["-map", "1:v:0" if encoded_video else "0:v:0"])  # Video: only map one stream
     ffmpeg_params.extend(["-map_chapters", "-1"])  # Chapters metadata: remove
 
-    has_compatible_audio = all(
-        [s["codec_name"] == "aac" and s["sample_rate"] in ("44100", "48000") for s in metadata["audio_streams"]]
-    )
-    has_compatible_video = (
-        metadata["video_streams"][0]["pix_fmt"] == "yuv420p" and metadata["video_streams"][0]["codec_name"] == "h264"
-    )
+    plan = get_conversion_plan(metadata)
+    logger.info(f"Conversion plan for {input_file.name}: {plan}")
 
     # Video
-    if has_compatible_video:
+    if plan in (REMUX, TRANSCODE_AUDIO):
         logger.info(f"Video stream in {input_file.name} is already ok; copying instead of converting.")
         ffmpeg_params.extend(["-codec:v", "copy"])
+    elif encoded_video:
+        ffmpeg_params.extend(["-codec:v", "copy"])  # Already converted in segments
     else:
-        ffmpeg_params.extend(["-codec:v", "libx264"])  # Best compatibility
-        ffmpeg_params.extend(["-crf", "23"])
-        ffmpeg_params.extend(["-fps_mode", "cfr"])  # Constant frame rate for better compatibility
-        ffmpeg_params.extend(["-filter:v", f"scale=-2:min(ih\\,{max_video_height})"])  # Limit resolution
-        ffmpeg_params.extend(["-maxrate", str(max_video_bitrate)])  # Limit bitrate
-        ffmpeg_params.extend(["-bufsize", str(max_video_bitrate * 1.5)])
-        ffmpeg_params.extend(["-vf", "format=yuv420p"])  # Prevent 10-bit HDR content and unusual pixel formats
+        ffmpeg_params.extend(get_video_encoding_params())
 
     # Audio
-    if has_compatible_audio and has_compatible_video:  # Compatible audio still needs to be synced with video
+    if plan in (REMUX, TRANSCODE_VIDEO):
         logger.info(f"Audio stream in {input_file.name} is already ok; copying instead of converting.")
         ffmpeg_params.extend(["-codec:a", "copy"])
     else:
@@ -97,13 +202,276 @@ def convert_for_streaming(input_file: Path, output_file: Path):
         for stream in metadata["supported_subtitle_streams"]:
             ffmpeg_params.extend(["-map", f"0:{stream['index']}"])
 
+    # Audio that starts before the video would have negative timestamps
+    if encoded_video:
+        ffmpeg_params.extend(["-avoid_negative_ts", "make_zero"])
+
     # Add the moov atom to enable streaming
     ffmpeg_params.extend(["-movflags", "+faststart"])
+    ffmpeg_params.append(str(output_file))
+
+    # Other outputs: subtitles
+    ffmpeg_params.extend(subtitle_params)
+
+    run_ffmpeg(ffmpeg_params, on_progress)
+
+
+def get_video_encoding_params() -> list[str]:
+    return [
+        "-codec:v",
+        "libx264",  # Best compatibility
+        "-crf",
+        "23",
+        "-fps_mode",
+        "cfr",  # Constant frame rate for better compatibility
+        "-maxrate",
+        str(max_video_bitrate),  # Limit bitrate
+        "-bufsize",
+        str(max_video_bitrate * 1.5),
+        "-filter:v",
+        # Limit resolution. Prevent 10-bit HDR content and unusual pixel formats.
+        f"scale=-2:min(ih\\,{max_video_height}),format=yuv420p",
+    ]
+
+
+def split_video(input_file: Path, work_dir: Path) -> list[tuple[Path, float]]:
+    """
+    Splits the video stream into segments of about `conversion_segment_duration` seconds, without converting it. The
+    video is only cut on keyframes, so that each segment can be decoded on its own.
+    Returns the (segment file, segment duration) of each segment. The video is only split once per work_dir.
+    """
+    segment_list = work_dir / "segments.csv"
+    if not segment_list.exists():
+        tmp_segment_list = segment_list.with_suffix(".tmp")
+        logger.info(f"Splitting {input_file.name} into {conversion_segment_duration}s segments")
+        run_ffmpeg(
+            [
+                ffmpeg_path,
+                "-loglevel",
+                "error",
+                "-y",
+                "-i",
+                str(input_file),
+                "-map",
+                "0:v:0",
+                "-codec",
+                "copy",
+                "-f",
+                "segment",
+                "-segment_time",
+                str(conversion_segment_duration),
+                "-reset_timestamps",
+                "1",
+                "-segment_list",
+                str(tmp_segment_list),
+                "-segment_list_type",
+                "csv",
+                str(work_dir / "source.%05d.mkv"),
+            ]
+        )
+        tmp_segment_list.rename(segment_list)
+
+    with segment_list.open(newline="") as segment_list_file:
+        return [(work_dir / name, float(end) - float(start)) for name, start, end in csv.reader(segment_list_file)]
+
+
+def convert_segment(source_file: Path, threads: int, on_progress: Callable[[ConversionProgress], None]) -> Path:
+    """
+    Converts a video segment from split_video(). Segments that were already converted are skipped.
+    """
+    output_file = source_file.with_name(source_file.name.replace("source.", "converted.")).with_suffix(".mp4")
+    if output_file.exists():
+        return output_file
+
+    tmp_file = output_file.with_suffix(".tmp")
+    ffmpeg_params = [
+        ffmpeg_path,
+        "-loglevel",
+        "error",
+        "-y",
+        "-i",
+        str(source_file),
+        "-map",
+        "0:v:0",
+        "-preset",
+        "slow",
+        "-threads",
+        str(threads),
+        *get_video_encoding_params(),
+        "-f",
+        "mp4",
+        str(tmp_file),
+    ]
+    run_ffmpeg(ffmpeg_params, on_progress)
+    tmp_file.rename(output_file)
+    return output_file
 
-    return subprocess.check_output([*ffmpeg_params, str(output_file)])
+
+def get_segment_dir(input_file: Path, work_dir: Path) -> Path:
+    """
+    Directory in `work_dir` where the segments of `input_file` are converted. Segments from a different file with the
+    same name are not reused.
+    """
+    stat = input_file.stat()
+    return work_dir / f"{input_file.stem.removesuffix('.original')}.{stat.st_ino}.{stat.st_size}"
+
+
+def convert_video_in_segments(
+    input_file: Path,
+    work_dir: Path,
+    threads: int = 0,
+    on_progress: Callable[[ConversionProgress], None] | None = None,
+) -> Path:
+    """
+    Converts the video stream of a file in segments, in parallel. The converted segments are kept in work_dir, so a
+    conversion that is interrupted resumes where it stopped. Returns the path of a concat list of the converted
+    segments.
+    """
+    work_dir.mkdir(parents=True, exist_ok=True)
+    segments = split_video(input_file, work_dir)
+
+    # The thread budget is divided between the segments that are converted at the same time
+    cpu_count = threads or os.cpu_count() or 1
+    parallel_segments = max(1, min(len(segments), cpu_count // segment_conversion_threads))
+    threads_per_segment = max(1, cpu_count // parallel_segments)
+    logger.info(
+        f"Converting {len(segments)} segments of {input_file.name}, "
+        f"{parallel_segments} at a time with {threads_per_segment} threads each"
+    )
+
+    # Progress of each segment, updated by the worker threads
+    segment_progress: dict[Path, ConversionProgress] = {}
+    converted_duration = 0.0
+
+    def update_progress(source_file: Path):
+        def set_segment_progress(progress: ConversionProgress):
+            segment_progress[source_file] = progress
+
+        return set_segment_progress
+
+    with ThreadPoolExecutor(max_workers=parallel_segments, thread_name_prefix="segment") as executor:
+        futures = {}
+        for source_file, duration in segments:
+            future = executor.submit(convert_segment, source_file, threads_per_segment, update_progress(source_file))
+            futures[future] = (source_file, duration)
+
+        # Report the combined progress of all segments from this thread, and not from the worker threads
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = wait(pending, timeout=1, return_when=FIRST_EXCEPTION)
+                for future in done:
+                    future.result()  # Raise conversion errors
+                    source_file, duration = futures[future]
+                    segment_progress.pop(source_file, None)
+                    converted_duration += duration
+                if on_progress:
+                    running = list(segment_progress.values())
+                    on_progress(
+                        ConversionProgress(
+                            out_time=converted_duration + sum(p.out_time for p in running),
+                            fps=sum(p.fps for p in running),
+                            speed=sum(p.speed for p in running),
+                        )
+                    )
+        except:
+            # Only wait for the segments that are already converting. The others would be converted for nothing.
+            executor.shutdown(cancel_futures=True)
+            raise
+
+    concat_list = work_dir / "converted.txt"
+    concat_list.write_text("".join(f"file '{future.result().name}'\n" for future in futures))
+    return concat_list
+
+
+def scale_progress(
+    on_progress: Callable[[ConversionProgress], None] | None, offset: float, share: float
+) -> Callable[[ConversionProgress], None] | None:
+    """
+    Reports the progress of one step of a conversion as progress of the whole conversion. The step starts after
+    `offset` seconds of the conversion's progress, and counts for `share` of it.
+    """
+    if not on_progress:
+        return None
+
+    def report_progress(progress: ConversionProgress):
+        on_progress(
+            ConversionProgress(
+                out_time=offset + progress.out_time * share,
+                fps=progress.fps,
+                speed=progress.speed * share,
+            )
+        )
+
+    return report_progress
+
+
+def get_conversion_plan(metadata: dict[str, Any]) -> str:
+    """
+    Returns the cheapest way to make a video streamable: REMUX, TRANSCODE_AUDIO, TRANSCODE_VIDEO or FULL_TRANSCODE
+    """
+    video_stream = metadata["video_streams"][0]
+    has_compatible_video = video_stream["pix_fmt"] == "yuv420p" and video_stream["codec_name"] == "h264"
+    has_compatible_audio = all(
+        [s["codec_name"] == "aac" and s["sample_rate"] in ("44100", "48000") for s in metadata["audio_streams"]]
+    )
+
+    # The converted video has a constant frame rate. Copied audio only stays in sync if the original's frame rate was
+    # already constant.
+    has_constant_frame_rate = video_stream.get("r_frame_rate") == video_stream.get("avg_frame_rate")
+
+    if has_compatible_video and has_compatible_audio:
+        return REMUX
+    elif has_compatible_video:
+        return TRANSCODE_AUDIO
+    elif has_compatible_audio and has_constant_frame_rate:
+        return TRANSCODE_VIDEO
+    return FULL_TRANSCODE
+
+
+def get_subtitle_output_params(
+    input_file: Path, subtitle_file_template: str | None, metadata: dict[str, Any]
+) -> list[str]:
+    """
+    ffmpeg output parameters to extract subs to .srt and .vtt files
+    https://nicolasbouliane.com/blog/ffmpeg-extract-subtitles
+    """
+    if not subtitle_file_template:
+        return []
+
+    ffmpeg_params = []
+    processed_languages = set()  # If multiple streams have the same language, only process the first one
+    for stream in metadata["supported_subtitle_streams"]:
+        lang = stream.get("tags", {}).get("language", "unknown")
+        if lang not in subtitle_languages or lang in processed_languages:
+            logger.info(f"Ignoring {lang} subtitles in {input_file.name}")
+            continue
+
+        processed_languages.add(lang)
+        for extension in ("srt", "vtt"):
+            subtitle_file = subtitle_file_template.format(language_code=lang, extension=extension)
+            logger.info(f"Extracting {lang} subtitles to {subtitle_file}")
+            codec = {"vtt": "webvtt", "srt": "srt"}[extension]
+            ffmpeg_params.extend(["-map", f"0:{stream['index']}", "-codec:s", codec, subtitle_file])
+    return ffmpeg_params
 
 
 def get_video_metadata(file: Path) -> dict[str, Any]:
+    """
+    Returns the video's metadata. ffprobe is slow on large files, so its output is cached until the file changes.
+    """
+    stat = file.stat()
+    cache_key = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino}
+    probe = VideoProbe.objects.filter(path=str(file), **cache_key).first()
+    if probe:
+        return probe.metadata
+
+    metadata = probe_video(file)
+    VideoProbe.objects.update_or_create(path=str(file), defaults={**cache_key, "metadata": metadata})
+    return metadata
+
+
+def probe_video(file: Path) -> dict[str, Any]:
     ffprobe_output = json.loads(
         subprocess.check_output(
             [
@@ -141,24 +509,198 @@ def get_video_metadata(file: Path) -> dict[str, Any]:
     }
 
 
-def process_video(input_file: Path):
+def get_hls_renditions(metadata: dict[str, Any]) -> list[tuple[int, int, int]]:
+    """
+    Returns the (width, height, max video bitrate) of the HLS renditions for a video. Videos are never upscaled.
+    """
+    source_width = int(metadata["video_streams"][0]["width"])
+    source_height = int(metadata["video_streams"][0]["height"])
+    heights = [(h, bitrate) for h, bitrate in hls_renditions if h <= source_height] or [
+        (source_height, hls_renditions[-1][1])
+    ]
+    return [(round(source_width * h / source_height / 2) * 2, h, bitrate) for h, bitrate in heights]
+
+
+def get_hls_output_params(playlist_file: Path) -> list[str]:
+    """
+    ffmpeg output parameters for an HLS playlist. The fMP4 segments are stored in a single file, and the playlist
+    points to byte ranges in that file. This keeps the number of files in the library small.
+    """
+    return [
+        "-f",
+        "hls",
+        "-hls_time",
+        str(hls_segment_duration),
+        "-hls_playlist_type",
+        "vod",
+        "-hls_segment_type",
+        "fmp4",
+        "-hls_flags",
+        "single_file",
+        "-hls_fmp4_init_filename",
+        playlist_file.with_suffix(".init.mp4").name,
+        "-hls_segment_filename",
+        str(playlist_file.with_suffix(".m4s")),
+        str(playlist_file),
+    ]
+
+
+def create_hls_rendition(input_file: Path, playlist_file: Path, height: int, bitrate: int, threads: int):
+    """
+    Encodes the video stream of one HLS rendition. The audio streams are separate renditions, so that they are not
+    duplicated in each video rendition.
+    """
+    # Keyframes at segment boundaries, so that all renditions can be switched at the same points
+    keyframe_expression = f"expr:gte(t,n_forced*{hls_segment_duration})"
+    ffmpeg_params = [
+        ffmpeg_path,
+        "-loglevel",
+        "error",
+        "-y",
+        "-i",
+        str(input_file),
+        "-map",
+        "0:v:0",
+        "-threads",
+        str(threads),
+        "-codec:v",
+        "libx264",
+        "-preset",
+        "slow",
+        "-crf",
+        "23",
+        "-maxrate",
+        str(bitrate),
+        "-bufsize",
+        str(int(bitrate * 1.5)),
+        "-filter:v",
+        f"scale=-2:{height},format=yuv420p",
+        "-force_key_frames",
+        keyframe_expression,
+        *get_hls_output_params(playlist_file),
+    ]
+    logger.info(f"Creating {height}p HLS rendition of {input_file.name}")
+    run_ffmpeg(ffmpeg_params)
+
+
+def create_hls_audio_rendition(input_file: Path, playlist_file: Path, audio_stream_index: int):
+    """
+    Encodes one audio stream of an HLS stream
+    """
+    ffmpeg_params = [
+        ffmpeg_path,
+        "-loglevel",
+        "error",
+        "-y",
+        "-i",
+        str(input_file),
+        "-map",
+        f"0:a:{audio_stream_index}",
+        "-codec:a",
+        "aac",
+        "-b:a",
+        "128k",
+        "-ac",
+        "2",
+        *get_hls_output_params(playlist_file),
+    ]
+    logger.info(f"Creating HLS audio rendition {audio_stream_index} of {input_file.name}")
+    run_ffmpeg(ffmpeg_params)
+
+
+def create_hls_ladder(input_file: Path, master_playlist_file: Path, threads: int):
+    """
+    Creates an adaptive bitrate HLS stream from a converted video, with one rendition per resolution, and one audio
+    rendition per audio stream. The renditions are encoded in parallel. The master playlist is written last, so it
+    only exists if all renditions are complete.
+    """
+    # The converted video can have a different resolution than the original
+    metadata = probe_video(input_file)
+    renditions = get_hls_renditions(metadata)
+    audio_streams = metadata["audio_streams"]
+    rendition_threads = max(1, threads // len(renditions)) if threads else 0
+    base_name = master_playlist_file.name.removesuffix(".m3u8")
+
+    with ThreadPoolExecutor(max_workers=len(renditions) + len(audio_streams)) as executor:
+        futures = [
+            executor.submit(
+                create_hls_rendition,
+                input_file,
+                master_playlist_file.with_name(f"{base_name}.{height}p.m3u8"),
+                height,
+                bitrate,
+                rendition_threads,
+            )
+            for width, height, bitrate in renditions
+        ]
+        futures += [
+            executor.submit(
+                create_hls_audio_rendition,
+                input_file,
+                master_playlist_file.with_name(f"{base_name}.audio{index}.m3u8"),
+                index,
+            )
+            for index in range(len(audio_streams))
+        ]
+        for future in futures:
+            future.result()  # Raise encoding errors
+
+    master_playlist = ["#EXTM3U", "#EXT-X-VERSION:7", "#EXT-X-INDEPENDENT-SEGMENTS"]
+    for index, stream in enumerate(audio_streams):
+        language = stream.get("tags", {}).get("language", "und")
+        # Names must be unique within the group, and can't contain double quotes
+        name = f"{stream.get('tags', {}).get('title', language)} ({index + 1})".replace('"', "'")
+        master_playlist.append(
+            f'#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="audio",LANGUAGE="{language}",NAME="{name}",'
+            f"DEFAULT={'YES' if index == 0 else 'NO'},AUTOSELECT=YES,"
+            f'URI="{quote(f"{base_name}.audio{index}.m3u8")}"'
+        )
+
+    audio_bitrate = 128_000 if audio_streams else 0
+    codecs = "avc1.640028,mp4a.40.2" if audio_streams else "avc1.640028"
+    audio_group = ',AUDIO="audio"' if audio_streams else ""
+    for width, height, bitrate in renditions:
+        master_playlist.append(
+            f"#EXT-X-STREAM-INF:BANDWIDTH={bitrate + audio_bitrate},RESOLUTION={width}x{height},"
+            f'CODECS="{codecs}"{audio_group}'
+        )
+        master_playlist.append(quote(f"{base_name}.{height}p.m3u8"))
+
+    tmp_playlist_file = master_playlist_file.with_suffix(".tmp")
+    tmp_playlist_file.write_text("\n".join(master_playlist) + "\n")
+    tmp_playlist_file.rename(master_playlist_file)
+
+
+def process_video(
+    input_file: Path,
+    threads: int = 0,
+    hls: bool = False,
+    on_progress: Callable[[ConversionProgress], None] | None = None,
+    work_dir: Path | None = None,
+) -> dict[str, Any]:
     """
     Converts an input file to a video that can be streamed in a web browser.
-    Extracts subtitles to separate files.
+    Extracts subtitles to separate files. Uses up to `threads` CPU threads.
+    If `hls` is True, also creates an adaptive bitrate HLS stream from the converted video.
+    Calls on_progress with the conversion's progress.
+    If `work_dir` is set, long videos are converted in resumable segments in a subdirectory of `work_dir`.
+    Returns the input file's metadata.
 
     The converted movie has the same name, but with a .converted.mp4 extension
 
     While it converts, it has the .converting.* extension.
     """
-    base_name = input_file.stem.rstrip(".original")
+    base_name = input_file.stem.removesuffix(".original")
     tmp_file = input_file.with_name(base_name + ".converting.mp4")
     output_file = input_file.with_name(base_name + ".converted.mp4")
     subtitle_file_template = str(input_file.with_name(base_name + ".{language_code}.{extension}"))
 
     metadata = get_video_metadata(input_file)
-    subtitle_streams_str = ", ".join([s["tags"].get("language", "unknown") for s in metadata["subtitle_streams"]])
+    subtitle_streams_str = ", ".join(
+        [s.get("tags", {}).get("language", "unknown") for s in metadata["subtitle_streams"]]
+    )
     supported_subtitle_streams_str = ", ".join(
-        [s["tags"].get("language", "unknown") for s in metadata["supported_subtitle_streams"]]
+        [s.get("tags", {}).get("language", "unknown") for s in metadata["supported_subtitle_streams"]]
     )
     logger.info(
         f"Processing {str(input_file)}:\n"
@@ -170,68 +712,91 @@ def process_video(input_file: Path):
         f"    - Supported subtitles: {supported_subtitle_streams_str or 'None'}"
     )
 
-    logger.info(f"Converting {input_file.name} to {output_file.name}")
-    convert_for_streaming(input_file, tmp_file)
-    output_file.unlink(missing_ok=True)
-    tmp_file.rename(output_file)
-
-    logger.info(f"Extracting .srt and .vtt subtitles from {input_file.name}")
-    extract_subtitles(input_file, subtitle_file_template)
-
-    for srt_file in get_subtitles_to_convert(input_file.parent):
-        if srt_file.name.startswith(base_name):
+    # A previous attempt can fail while creating the HLS stream, after the .mp4 was converted. The .mp4 is only
+    # converted again if the original is newer.
+    if output_file.exists() and output_file.stat().st_mtime_ns >= input_file.stat().st_mtime_ns:
+        logger.info(f"{output_file.name} was already converted")
+    else:
+        # Segments only help when the video stream is converted
+        segment_dir = None
+        if (
+            work_dir
+            and get_conversion_plan(metadata) in (TRANSCODE_VIDEO, FULL_TRANSCODE)
+            and metadata["duration"] > conversion_segment_duration * 2
+        ):
+            segment_dir = get_segment_dir(input_file, work_dir)
+
+        logger.info(f"Converting {input_file.name} to {output_file.name}, and extracting .srt and .vtt subtitles")
+        if segment_dir:
+            # ffmpeg only creates the .converting.mp4 file after the segments are converted. The video is already
+            # converting before that.
+            tmp_file.touch()
+            try:
+                encoded_video = convert_video_in_segments(
+                    input_file, segment_dir, threads, scale_progress(on_progress, 0, segmented_video_share)
+                )
+            except:
+                tmp_file.unlink(missing_ok=True)
+                raise
+            convert_for_streaming(
+                input_file,
+                tmp_file,
+                subtitle_file_template,
+                threads,
+                metadata,
+                scale_progress(on_progress, metadata["duration"] * segmented_video_share, 1 - segmented_video_share),
+                encoded_video=encoded_video,
+            )
+        else:
+            convert_for_streaming(input_file, tmp_file, subtitle_file_template, threads, metadata, on_progress)
+        output_file.unlink(missing_ok=True)
+        tmp_file.rename(output_file)
+        if segment_dir:
+            shutil.rmtree(segment_dir)
+
+    if hls:
+        logger.info(f"Creating HLS stream from {output_file.name}")
+        create_hls_ladder(output_file, input_file.with_name(base_name + ".hls.m3u8"), threads)
+
+    # User-uploaded .srt subtitles that don't have matching .vtt subtitles
+    for language_code in subtitle_languages:
+        srt_file = Path(subtitle_file_template.format(language_code=language_code, extension="srt"))
+        if srt_file.exists() and not srt_file.with_suffix(".vtt").exists():
             convert_subtitles_to_vtt(srt_file)
 
     logger.info(f"Conversion finished. Deleting original at {input_file.name}.")
+    return metadata
 
 
 def convert_subtitles_to_vtt(input_file: Path):
     output_file = Path(input_file).with_suffix(".vtt")
-    output_file.unlink(missing_ok=True)
-    ffmpeg_command = [ffmpeg_path, "-y", "-loglevel", "error", "-i", str(input_file), str(output_file)]
+    logger.info(f"Converting {input_file.name} subtitles to .vtt")
+    srt_bytes = input_file.read_bytes()
     try:
-        logger.info(f"Converting {input_file.name} subtitles to .vtt")
-        subprocess.check_output(ffmpeg_command)
-    except subprocess.CalledProcessError as e:
-        logger.exception(f"Could not convert subtitles in {input_file.name}. {e.output.decode('utf-8')}")
-        raise
-
-
-def extract_subtitles(input_file: Path, subtitle_file_template: str):
-    """
-    Extract subs to .srt and .vtt files
-    https://nicolasbouliane.com/blog/ffmpeg-extract-subtitles
-    """
-    ffmpeg_command = [
-        ffmpeg_path,
-        "-fix_sub_duration",
-        "-y",
-        "-loglevel",
-        "error",
-        "-i",
-        str(input_file),
-    ]
+        srt = srt_bytes.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        srt = srt_bytes.decode("cp1252", errors="replace")  # Most common encoding for older subtitles
+    output_file.write_text(srt_to_vtt(srt), encoding="utf-8")
 
-    processed_languages = set()  # If multiple streams have the same language, only process the first one
-    for stream in get_video_metadata(input_file)["supported_subtitle_streams"]:
-        lang = stream["tags"].get("language", "unknown")
-        if lang not in subtitle_languages and lang not in processed_languages:
-            logger.info(f"Ignoring {lang} subtitles in {input_file.name}")
-            continue
 
-        processed_languages.add(lang)
-        for extension in ("srt", "vtt"):
-            subtitle_file = subtitle_file_template.format(language_code=lang, extension=extension)
-            logger.info(f"Extracting {lang} subtitles to {subtitle_file}")
-            codec = {"vtt": "webvtt", "srt": "srt"}[extension]
-            ffmpeg_command.extend(["-map", f"0:{stream['index']}", "-codec:s", codec, subtitle_file])
+srt_timing = re.compile(r"^\s*(\d+):(\d{2}):(\d{2})[,.](\d{1,3})\s*-->\s*(\d+):(\d{2}):(\d{2})[,.](\d{1,3})")
+srt_font_tag = re.compile(r"</?font[^>]*>", re.IGNORECASE)
 
-    if not len(processed_languages):
-        return
 
-    try:
-        logger.info(f"Extracting all subtitles from {input_file.name}")
-        subprocess.check_output(ffmpeg_command)
-    except subprocess.CalledProcessError as e:
-        logger.exception(f"Could not extract subtitles from {input_file.name}. {e.output.decode('utf-8')}")
-        raise
+def srt_to_vtt(srt: str) -> str:
+    """
+    Converts SubRip subtitles to WebVTT subtitles. SRT cue numbers are valid WebVTT cue identifiers, so only the
+    timings and the unsupported <font> tags need to change.
+    """
+    vtt_lines = ["WEBVTT", ""]
+    for line in srt.replace("\r\n", "\n").replace("\r", "\n").split("\n"):
+        if timing := srt_timing.match(line):
+            start_h, start_m, start_s, start_ms, end_h, end_m, end_s, end_ms = timing.groups()
+            line = (
+                f"{int(start_h):02}:{start_m}:{start_s}.{start_ms.ljust(3, '0')} --> "
+                f"{int(end_h):02}:{end_m}:{end_s}.{end_ms.ljust(3, '0')}"
+            )
+        else:
+            line = srt_font_tag.sub("", line)
+        vtt_lines.append(line)
+    return "\n".join(vtt_lines).rstrip("\n") + "\n"
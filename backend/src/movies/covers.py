@@ -0,0 +1,68 @@
+import logging
+import subprocess
+from pathlib import Path
+
+import requests
+
+from .convert import ffmpeg_path
+from .models import Episode
+
+logger = logging.getLogger(__name__)
+
+# The cover grid has 2 to 4 columns. Covers are about 250px wide, 500px on high density screens.
+thumbnail_widths = (250, 500)
+thumbnail_formats = (
+    (".webp", ["-codec:v", "libwebp", "-quality", "80"]),
+    (".jpg", ["-qscale:v", "4"]),
+)
+
+request_timeout = (5, 30)  # Seconds to connect, seconds between bytes
+
+
+def download_cover(url: str, cover_path: Path):
+    """
+    Downloads a cover, and creates its thumbnails. The cover is only replaced once it's fully downloaded.
+    """
+    tmp_path = cover_path.with_suffix(".tmp")
+    with requests.get(url, stream=True, timeout=request_timeout) as response:
+        response.raise_for_status()
+        with tmp_path.open("wb") as cover_file:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                cover_file.write(chunk)
+    tmp_path.rename(cover_path)
+
+
+def create_cover_thumbnails(episode: Episode):
+    """
+    Creates smaller versions of the movie's cover for the cover grid, in WebP and JPEG format
+    """
+    for width in thumbnail_widths:
+        for extension, codec_params in thumbnail_formats:
+            thumbnail_path = episode.cover_thumbnail_path(width, extension)
+            tmp_path = thumbnail_path.with_name(f"{thumbnail_path.stem}.tmp{extension}")
+            subprocess.check_output(
+                [
+                    ffmpeg_path,
+                    "-loglevel",
+                    "error",
+                    "-y",
+                    "-i",
+                    str(episode.cover_path),
+                    "-filter:v",
+                    f"scale={width}:-2",
+                    *codec_params,
+                    "-frames:v",
+                    "1",
+                    str(tmp_path),
+                ],
+                stderr=subprocess.PIPE,
+            )
+            tmp_path.rename(thumbnail_path)
+
+
+def has_cover_thumbnails(episode: Episode) -> bool:
+    return all(
+        episode.cover_thumbnail_path(width, extension).exists()
+        for width in thumbnail_widths
+        for extension, codec_params in thumbnail_formats
+    )
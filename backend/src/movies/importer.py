@@ -0,0 +1,143 @@
+import logging
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .models import ConversionJob, Episode, EpisodeWatchStatus, IgnoredTriageFile, LibraryVersion
+
+logger = logging.getLogger(__name__)
+
+
+def link_original_video(episode: Episode, triage_options: dict) -> bool:
+    """
+    Creates a hard link to the video in the triage directory, so that it can be in the triage directory and in the
+    movie library at the same time. If the movie is already in the library, overwrite the file.
+    Returns False if there is no video to link.
+    """
+    if not triage_options.get("movieFile"):
+        return False
+
+    episode_triage_path = settings.TRIAGE_PATH / Path(triage_options["movieFile"])
+    if not episode_triage_path.exists():
+        return False
+
+    episode.triage_path = episode_triage_path
+
+    # If it replaces an existing episode
+    episode.original_video_path.unlink(missing_ok=True)
+    episode.original_video_path.hardlink_to(episode.triage_path)
+    episode.converted_video_path.unlink(missing_ok=True)
+    return True
+
+
+def link_subtitles(episode: Episode, triage_options: dict) -> list[Path]:
+    """
+    Creates hard links to the subtitle files in the triage directory. Returns the paths of the linked files.
+    """
+    linked_subtitles = []
+    for json_language, sub_language in (
+        ("En", "eng"),
+        ("De", "ger"),
+        ("Fr", "fre"),
+    ):
+        if not triage_options.get(f"subtitlesFile{json_language}"):
+            continue
+
+        subtitles_triage_path = settings.TRIAGE_PATH / triage_options[f"subtitlesFile{json_language}"]
+        assert subtitles_triage_path.exists()
+
+        subtitles_original_video_path: Path = episode.subtitles_path(".srt", sub_language)
+        logger.info(f'Copying subtitles "{subtitles_triage_path!s}" to "{subtitles_original_video_path!s}"')
+        subtitles_original_video_path.unlink(missing_ok=True)
+        subtitles_original_video_path.hardlink_to(subtitles_triage_path)
+        linked_subtitles.append(subtitles_triage_path)
+    return linked_subtitles
+
+
+@transaction.atomic
+def import_episodes(payload: dict, user: User) -> list[Episode]:
+    """
+    Create or update a movie/show with a list of episodes, link their files from the triage directory, and queue their
+    conversion. Uses the same number of queries for 1 episode or for a whole box set.
+    """
+    tmdb_id = payload.get("tmdbId")
+    media_type = payload.get("mediaType", Episode.MOVIE)
+    episodes_by_number = {
+        (e.season, e.episode): e for e in Episode.objects.filter(tmdb_id=tmdb_id, media_type=media_type)
+    }
+
+    episodes: list[tuple[Episode, dict]] = []
+    new_episodes: list[Episode] = []
+    episodes_to_convert: list[Episode] = []
+    linked_subtitles: list[Path] = []
+    for json_episode in payload.get("episodes", []):
+        season, episode_number = json_episode.get("season", None), json_episode.get("episode", None)
+        episode = episodes_by_number.get((season, episode_number))
+        if episode is None:
+            episode = Episode(tmdb_id=tmdb_id, season=season, episode=episode_number, media_type=media_type)
+            episodes_by_number[(season, episode_number)] = episode
+            new_episodes.append(episode)
+
+        if payload.get("title"):
+            episode.title = payload.get("title")
+        if payload.get("description"):
+            episode.description = payload.get("description")
+        if json_episode.get("releaseYear"):
+            episode.release_year = json_episode.get("releaseYear")
+
+        triage_options = json_episode.get("triage", {})
+        if link_original_video(episode, triage_options):
+            episodes_to_convert.append(episode)
+        linked_subtitles.extend(link_subtitles(episode, triage_options))
+
+        episodes.append((episode, json_episode))
+
+    Episode.objects.bulk_create(new_episodes)
+
+    # Set after bulk_create(), because auto_now_add replaces date_added on creation
+    for episode, json_episode in episodes:
+        if "dateAdded" in json_episode:
+            episode.date_added = json_episode.get("dateAdded")
+    Episode.objects.bulk_update(
+        [episode for episode, json_episode in episodes],
+        ["title", "description", "date_added", "release_year", "triage_path"],
+    )
+
+    # Watch progress imported from another server
+    episodes_with_progress = [
+        (episode, json_episode)
+        for episode, json_episode in episodes
+        if "progress" in json_episode or "lastWatched" in json_episode
+    ]
+    if episodes_with_progress:
+        existing_watch_statuses = {
+            s.episode_id: s
+            for s in EpisodeWatchStatus.objects.filter(
+                user=user, episode__in=[episode for episode, json_episode in episodes_with_progress]
+            )
+        }
+        watch_statuses = []
+        for episode, json_episode in episodes_with_progress:
+            watch_status = existing_watch_statuses.get(episode.pk) or EpisodeWatchStatus(user=user, episode=episode)
+            if "progress" in json_episode:
+                watch_status.stopped_at = json_episode.get("progress", 0)
+            if "lastWatched" in json_episode:
+                watch_status.last_watched = json_episode.get("lastWatched")
+            watch_statuses.append(watch_status)
+        EpisodeWatchStatus.objects.bulk_create(
+            watch_statuses,
+            update_conflicts=True,
+            unique_fields=["episode", "user"],
+            update_fields=["stopped_at", "last_watched", "updated_at"],
+        )
+
+    ConversionJob.enqueue_many(episodes_to_convert)
+    IgnoredTriageFile.objects.bulk_create(
+        [IgnoredTriageFile(path=str(path)) for path in linked_subtitles], ignore_conflicts=True
+    )
+
+    # Bulk queries don't send the signals that update the library version
+    LibraryVersion.bump()
+    return [episode for episode, json_episode in episodes]
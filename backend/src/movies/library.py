@@ -0,0 +1,98 @@
+import gzip
+import json
+import logging
+from dataclasses import dataclass
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .covers import thumbnail_widths
+from .library_index import library_index
+from .models import Episode, LibraryVersion
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class LibrarySnapshot:
+    version: str
+    movies: list[dict]
+    json: bytes
+    gzipped_json: bytes
+
+
+_snapshot: LibrarySnapshot | None = None
+
+
+def build_library_snapshot(version: str) -> LibrarySnapshot:
+    """
+    Serialize all movies/shows and their episodes, without any user-specific data
+    """
+    episodes_by_tmdb_id: dict[str, list[Episode]] = {}
+    for episode in Episode.objects.all():
+        episodes_by_tmdb_id.setdefault(episode.tmdb_id, []).append(episode)
+
+    movies = []
+    for tmdb_id, episodes in episodes_by_tmdb_id.items():
+        movies.append(
+            {
+                "tmdbId": tmdb_id,
+                "mediaType": episodes[0].media_type,
+                "title": episodes[0].title,
+                "description": episodes[0].description,
+                "coverUrl": episodes[0].cover_url,
+                "coverThumbnails": [
+                    {
+                        "width": width,
+                        "webpUrl": episodes[0].cover_thumbnail_url(width, ".webp"),
+                        "jpegUrl": episodes[0].cover_thumbnail_url(width, ".jpg"),
+                    }
+                    for width in thumbnail_widths
+                    if library_index.exists(episodes[0].cover_thumbnail_filename(width, ".webp"))
+                    and library_index.exists(episodes[0].cover_thumbnail_filename(width, ".jpg"))
+                ],
+                "episodes": [
+                    {
+                        "conversionStatus": episode.conversion_status,
+                        "dateAdded": episode.date_added,
+                        "duration": episode.duration,
+                        "id": episode.id,
+                        "originalVideoUrl": episode.original_video_url,
+                        "season": episode.season,
+                        "episode": episode.episode,
+                        "releaseYear": episode.release_year,
+                        "hlsPlaylistUrl": (
+                            episode.hls_playlist_url if library_index.exists(episode.hls_playlist_filename) else None
+                        ),
+                        "hasOriginalVersion": library_index.exists(episode.original_video_filename),
+                        "hasSubtitles": library_index.exists(episode.subtitles_filename(".vtt", "eng")),
+                        "subtitleLanguages": {
+                            "srt": library_index.subtitle_languages(episode, ".srt"),
+                            "vtt": library_index.subtitle_languages(episode, ".vtt"),
+                        },
+                    }
+                    for episode in episodes
+                ],
+            }
+        )
+
+    serialized_movies = json.dumps({"movies": movies}, cls=DjangoJSONEncoder).encode()
+    return LibrarySnapshot(
+        version=version,
+        movies=movies,
+        json=serialized_movies,
+        gzipped_json=gzip.compress(serialized_movies, mtime=0),
+    )
+
+
+def get_library_snapshot() -> LibrarySnapshot:
+    """
+    Return the cached library snapshot, or rebuild it if the library changed since it was built. Files can change
+    without going through Django, so the library directory's mtime is also part of the version.
+    """
+    global _snapshot
+    library_index.refresh(force=True)
+    version = f"{LibraryVersion.current()}.{library_index.mtime_ns or 0}"
+    if _snapshot is None or _snapshot.version != version:
+        logger.info(f"Rebuilding library snapshot for version {version}")
+        _snapshot = build_library_snapshot(version)
+    return _snapshot
@@ -0,0 +1,65 @@
+import logging
+import os
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LibraryIndex:
+    """
+    In-memory list of the files in the movie library, so that file checks don't need a stat() call per file.
+
+    The library directory is flat, so its mtime changes whenever a file is added, removed or renamed. The directory is
+    only listed again when its mtime changes, and its mtime is checked at most once every `refresh_interval` seconds.
+    """
+
+    refresh_interval = 1  # Seconds
+
+    def __init__(self):
+        self.mtime_ns: int | None = None
+        self.filenames: frozenset[str] = frozenset()
+        self.checked_at = 0.0
+
+    @property
+    def path(self) -> Path:
+        return settings.MOVIE_LIBRARY_PATH
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.checked_at < self.refresh_interval:
+            return
+        self.checked_at = now
+
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self.mtime_ns, self.filenames = None, frozenset()
+            return
+
+        if mtime_ns != self.mtime_ns:
+            with os.scandir(self.path) as entries:
+                self.filenames = frozenset(entry.name for entry in entries)
+            self.mtime_ns = mtime_ns
+            logger.debug(f"Indexed {len(self.filenames)} files in {str(self.path)}")
+
+    def exists(self, filename: Path | str) -> bool:
+        self.refresh()
+        return str(filename) in self.filenames
+
+    def conversion_status(self, episode) -> int:
+        if self.exists(episode.temporary_video_filename):
+            return episode.CONVERTING
+        elif self.exists(episode.converted_video_filename):
+            return episode.CONVERTED
+        return episode.NOT_CONVERTED
+
+    def subtitle_languages(self, episode, extension=".vtt") -> list[str]:
+        from .convert import subtitle_languages
+
+        return [lang for lang in subtitle_languages if self.exists(episode.subtitles_filename(extension, lang))]
+
+
+library_index = LibraryIndex()
@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from movies.triage import get_triage_file_kind, parse_name, parse_name_cached
+import time
+
+
+class Command(BaseCommand):
+    help = "Measures how long it takes to parse the file names in the triage directory, with and without a cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rounds", type=int, default=3, help="Number of times each name is parsed")
+
+    def handle(self, *args, **options):
+        names = [f.name for f in settings.TRIAGE_PATH.rglob("*") if get_triage_file_kind(f.name)]
+        if not names:
+            self.stdout.write(f"There are no video or subtitle files in {settings.TRIAGE_PATH}")
+            return
+
+        rounds = max(1, options["rounds"])
+
+        def time_per_name(parse, rounds: int) -> float:
+            started_at = time.perf_counter()
+            for _ in range(rounds):
+                for name in names:
+                    parse(name)
+            return (time.perf_counter() - started_at) / (rounds * len(names)) * 1_000_000
+
+        uncached_time = time_per_name(parse_name_cached.__wrapped__, rounds)
+        parse_name_cached.cache_clear()
+        first_parse_time = time_per_name(parse_name, 1)
+        cached_time = time_per_name(parse_name, rounds)
+
+        self.stdout.write(f"{len(names)} file names in {settings.TRIAGE_PATH}")
+        self.stdout.write(f"Without cache:       {uncached_time:.1f} µs per name")
+        self.stdout.write(f"Cache miss:          {first_parse_time:.1f} µs per name")
+        self.stdout.write(
+            f"Cache hit:           {cached_time:.1f} µs per name ({uncached_time / cached_time:.0f}x faster)"
+        )
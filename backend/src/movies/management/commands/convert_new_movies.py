@@ -1,21 +1,176 @@
+from concurrent.futures import Future, ThreadPoolExecutor
 from django.conf import settings
 from django.core.management.base import BaseCommand
-from movies.convert import get_videos_to_process, process_video
+from django.db import connection
+from movies.convert import (
+    ConversionProgress,
+    get_conversion_plan,
+    get_segment_dir,
+    get_video_metadata,
+    lock_video,
+    process_video,
+)
+from movies.models import ConversionJob, Episode, LibraryVersion
+from movies.notify import NotificationListener, notify
 import logging
+import os
+import shutil
+import socket
+import subprocess
 import time
+import traceback
 
 
 logger = logging.getLogger(__name__)
 
+# Conversions are started as soon as they are queued. This slower scan finds episodes that were not queued.
+reconciliation_interval = 600  # Seconds
+
+# ffmpeg reports its progress twice per second. It's saved less often to avoid database writes.
+progress_save_interval = 5  # Seconds
+
+# How long to wait before giving back a job whose video is locked by another converter
+locked_video_retry_delay = 60  # Seconds
+
 
 class Command(BaseCommand):
     help = "Converts all unconverted movies until stopped"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.CONVERSION_WORKERS,
+            help="Number of videos to convert at the same time",
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=settings.CONVERSION_THREADS_PER_JOB,
+            help="Number of CPU threads per conversion. Divides the CPU cores between workers by default.",
+        )
+
     def handle(self, *args, **options):
-        while True:
-            for movie_path in get_videos_to_process(settings.MOVIE_LIBRARY_PATH):
+        workers = max(1, options["workers"])
+        threads = options["threads"] or max(1, (os.cpu_count() or 1) // workers)
+        logger.info(f"Converting videos with {workers} workers and {threads} threads per worker")
+
+        # Other converters can run at the same time. Only the jobs of dead converters are put back in the queue.
+        # A running job with this worker ID belongs to a previous converter process with the same hostname and PID.
+        worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        if reclaimed_count := ConversionJob.reclaim_stalled(dead_worker=worker_id):
+            logger.info(f"Reclaimed {reclaimed_count} jobs of stopped converters")
+
+        # Each worker thread waits on its own ffmpeg process, so threads don't compete for the GIL
+        with (
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix="converter") as executor,
+            NotificationListener(settings.CONVERTER_SOCKET_PATH) as listener,
+        ):
+            jobs: set[Future] = set()
+            last_reconciliation = None
+            while True:
+                if last_reconciliation is None or time.monotonic() - last_reconciliation > reconciliation_interval:
+                    if enqueued_count := ConversionJob.enqueue_unconverted():
+                        logger.info(f"Queued {enqueued_count} unconverted episodes")
+                    self.delete_orphaned_work_dirs()
+                    last_reconciliation = time.monotonic()
+
+                ConversionJob.heartbeat(worker_id)
+                if reclaimed_count := ConversionJob.reclaim_stalled():
+                    logger.info(f"Reclaimed {reclaimed_count} jobs of stopped converters")
+
+                jobs = {job for job in jobs if not job.done()}
+                while len(jobs) < workers and (job := ConversionJob.claim(worker_id)):
+                    jobs.add(executor.submit(self.convert_video, job, threads))
+
+                # Woken up when a job is queued, when a worker is done, or when it's time for a heartbeat
+                listener.wait(timeout=ConversionJob.HEARTBEAT_INTERVAL)
+
+    def delete_orphaned_work_dirs(self):
+        """
+        Delete the converted segments that won't be used to resume a conversion. They are left behind when a job
+        is reclaimed after too many attempts, or when the original video is replaced.
+        """
+        work_path = settings.CONVERSION_WORK_PATH
+        if not work_path.exists():
+            return
+
+        used_work_dirs = set()
+        for job in ConversionJob.objects.filter(state__in=(ConversionJob.PENDING, ConversionJob.RUNNING)):
+            try:
+                used_work_dirs.add(get_segment_dir(job.episode.original_video_path, work_path))
+            except OSError:  # The original video is missing
+                pass
+
+        for work_dir in work_path.iterdir():
+            if work_dir.is_dir() and work_dir not in used_work_dirs:
+                logger.info(f"Deleting orphaned conversion segments in {str(work_dir)}")
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    def convert_video(self, job: ConversionJob, threads: int):
+        movie_path = job.episode.original_video_path
+        logger.info(f"Starting conversion of {movie_path.name} (attempt {job.attempts}, priority {job.priority})")
+        try:
+            if not movie_path.exists():
+                job.fail(f"Original video not found at {str(movie_path)}")
+                return
+
+            with lock_video(movie_path) as is_locked:
+                if not is_locked:
+                    # Not the video's fault, so it does not count as an attempt. Waiting avoids claiming it again and
+                    # again while the other converter is working on it.
+                    logger.warning(f"{movie_path.name} is locked by another converter")
+                    time.sleep(locked_video_retry_delay)
+                    job.release()
+                    return
+
+                LibraryVersion.bump()  # The movie's conversion status changes to "converting"
+                started_at = time.monotonic()
                 try:
-                    process_video(movie_path)
+                    metadata = get_video_metadata(movie_path)
+                    job.plan = get_conversion_plan(metadata)
+                    job.save(update_fields=["plan"])
+                    # The ETA of the conversion is based on the episode's duration, which is unknown before the first
+                    # conversion
+                    Episode.objects.filter(pk=job.episode_id).update(duration=metadata["duration"])
+                    metadata = process_video(
+                        movie_path,
+                        threads,
+                        hls=settings.CONVERSION_HLS,
+                        on_progress=self.progress_saver(job, metadata["duration"]),
+                        work_dir=settings.CONVERSION_WORK_PATH,
+                    )
+                    Episode.objects.filter(pk=job.episode_id).update(duration=metadata["duration"])
+                except subprocess.CalledProcessError as e:
+                    logger.exception(f"Could not convert video {str(movie_path)}")
+                    job.fail(e.stderr.decode("utf-8", errors="replace") if e.stderr else str(e))
                 except:
                     logger.exception(f"Could not convert video {str(movie_path)}")
-            time.sleep(30)
+                    job.fail(traceback.format_exc())
+                else:
+                    job.succeed()
+                    logger.info(
+                        f"Converted {movie_path.name} with the {job.get_plan_display()} plan "
+                        f"in {time.monotonic() - started_at:.0f} seconds"
+                    )
+                finally:
+                    LibraryVersion.bump()
+        finally:
+            connection.close()  # Each worker thread has its own database connection
+            notify(settings.CONVERTER_SOCKET_PATH)  # This worker is free
+
+    def progress_saver(self, job: ConversionJob, duration: float):
+        last_saved_at = 0.0
+
+        def save_progress(progress: ConversionProgress):
+            nonlocal last_saved_at
+            if time.monotonic() - last_saved_at < progress_save_interval:
+                return
+            last_saved_at = time.monotonic()
+            percent = min(100, progress.out_time / duration * 100) if duration else 0
+            job.set_progress(percent, progress.fps, progress.speed)
+            logger.debug(
+                f"{job.episode.original_video_filename}: {percent:.1f}% at {progress.fps:.1f} fps ({progress.speed}x)"
+            )
+
+        return save_progress
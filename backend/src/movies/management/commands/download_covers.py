@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from movies.covers import create_cover_thumbnails, download_cover, has_cover_thumbnails
+from movies.models import CoverDownload, Episode
+from movies.notify import NotificationListener
+import logging
+import subprocess
+import time
+import traceback
+
+
+logger = logging.getLogger(__name__)
+
+# Downloads are started as soon as they are queued. This slower scan finds covers without thumbnails.
+reconciliation_interval = 3600  # Seconds
+
+
+class Command(BaseCommand):
+    help = "Downloads movie covers and creates their thumbnails until stopped"
+
+    def handle(self, *args, **options):
+        with NotificationListener(settings.COVER_DOWNLOADER_SOCKET_PATH) as listener:
+            last_reconciliation = None
+            while True:
+                if last_reconciliation is None or time.monotonic() - last_reconciliation > reconciliation_interval:
+                    self.create_missing_thumbnails()
+                    last_reconciliation = time.monotonic()
+
+                for download in CoverDownload.objects.filter(next_attempt_at__lte=timezone.now()):
+                    self.download(download)
+
+                # Woken up when a download is queued, or when a failed download can be retried
+                next_download = CoverDownload.objects.exclude(next_attempt_at=None).order_by("next_attempt_at").first()
+                timeout = reconciliation_interval
+                if next_download:
+                    timeout = min(timeout, max(0, (next_download.next_attempt_at - timezone.now()).total_seconds()))
+                listener.wait(timeout=timeout)
+
+    def download(self, download: CoverDownload):
+        episode = Episode.objects.filter(tmdb_id=download.tmdb_id).first()
+        if episode is None:  # The movie was deleted
+            download.delete()
+            return
+
+        logger.info(f"Downloading cover of {episode.title} from {download.url}")
+        try:
+            download_cover(download.url, episode.cover_path)
+            create_cover_thumbnails(episode)
+        except subprocess.CalledProcessError as e:
+            logger.exception(f"Could not create thumbnails for {episode.cover_filename}")
+            download.fail(e.stderr.decode("utf-8", errors="replace") if e.stderr else str(e))
+        except:
+            logger.exception(f"Could not download cover from {download.url}")
+            download.fail(traceback.format_exc())
+        else:
+            # Unless the download was queued again with a different URL in the meantime
+            CoverDownload.objects.filter(pk=download.pk, url=download.url).delete()
+
+    def create_missing_thumbnails(self):
+        for tmdb_id in Episode.objects.values_list("tmdb_id", flat=True).distinct():
+            episode = Episode.objects.filter(tmdb_id=tmdb_id).first()
+            if not episode.cover_path.exists() or has_cover_thumbnails(episode):
+                continue
+            logger.info(f"Creating missing thumbnails for {episode.cover_filename}")
+            try:
+                create_cover_thumbnails(episode)
+            except subprocess.CalledProcessError:
+                logger.exception(f"Could not create thumbnails for {episode.cover_filename}")
@@ -2,14 +2,13 @@ from django.core.management.base import BaseCommand
 from movies.convert import get_video_metadata
 from movies.models import Episode
 import logging
-import time
 
 
 logger = logging.getLogger(__name__)
 
 
 class Command(BaseCommand):
-    help = "Set the duration of all movies"
+    help = "Set the duration of converted movies that don't have one. New conversions set it automatically."
 
     def handle(self, *args, **options):
         for episode in Episode.objects.filter(duration=None):
@@ -22,4 +21,3 @@ class Command(BaseCommand):
             except:
                 logger.exception("Could not get episode duration")
             episode.save()
-        time.sleep(30)
@@ -0,0 +1,24 @@
+# Generated by Django 6.0.5 on 2026-10-18 19:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("movies", "0025_ignoredtriagefile"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LibraryVersion",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("version", models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="ignoredtriagefile",
+            name="id",
+            field=models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID"),
+        ),
+    ]
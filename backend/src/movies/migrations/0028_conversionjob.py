@@ -0,0 +1,42 @@
+# Generated by Django 6.0.5 on 2026-10-18 19:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("movies", "0027_user_state_updated_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ConversionJob",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "state",
+                    models.SmallIntegerField(
+                        choices=[(0, "pending"), (1, "running"), (2, "done"), (3, "failed")], default=0
+                    ),
+                ),
+                ("priority", models.SmallIntegerField(default=0)),
+                ("attempts", models.PositiveSmallIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+                ("last_error", models.TextField(blank=True)),
+                (
+                    "episode",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="conversion_job", to="movies.episode"
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["state", "-priority", "created_at"], name="movies_conv_state_1c3794_idx")
+                ],
+            },
+        ),
+    ]
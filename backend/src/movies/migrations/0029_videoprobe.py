@@ -0,0 +1,24 @@
+# Generated by Django 6.0.5 on 2026-10-18 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("movies", "0028_conversionjob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="VideoProbe",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("path", models.CharField(max_length=500, unique=True)),
+                ("size", models.PositiveBigIntegerField()),
+                ("mtime_ns", models.PositiveBigIntegerField()),
+                ("inode", models.PositiveBigIntegerField()),
+                ("metadata", models.JSONField()),
+                ("probed_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 6.0.5 on 2026-10-18 19:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("movies", "0029_videoprobe"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversionjob",
+            name="plan",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("remux", "remux"),
+                    ("audio", "convert audio"),
+                    ("video", "convert video"),
+                    ("full", "convert video and audio"),
+                ],
+                max_length=10,
+            ),
+        ),
+    ]
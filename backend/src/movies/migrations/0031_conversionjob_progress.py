@@ -0,0 +1,32 @@
+# Generated by Django 6.0.5 on 2026-10-18 19:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("movies", "0030_conversionjob_plan"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversionjob",
+            name="fps",
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name="conversionjob",
+            name="progress",
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name="conversionjob",
+            name="progress_updated_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="conversionjob",
+            name="speed",
+            field=models.FloatField(default=0),
+        ),
+    ]
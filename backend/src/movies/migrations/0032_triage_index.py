@@ -0,0 +1,48 @@
+# Generated by Django 6.0.5 on 2026-10-18 19:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("movies", "0031_conversionjob_progress"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TriageDirectory",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("path", models.CharField(max_length=500, unique=True)),
+                ("mtime_ns", models.BigIntegerField(null=True)),
+                (
+                    "parent",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="subdirectories",
+                        to="movies.triagedirectory",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "triage directories",
+            },
+        ),
+        migrations.CreateModel(
+            name="TriageFile",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("path", models.CharField(max_length=500, unique=True)),
+                ("kind", models.PositiveSmallIntegerField(choices=[(1, "video"), (2, "subtitles")])),
+                ("parsed_name", models.JSONField(default=dict)),
+                (
+                    "directory",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="files", to="movies.triagedirectory"
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 6.0.5 on 2026-10-18 19:42
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("movies", "0032_triage_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CoverDownload",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("tmdb_id", models.CharField(max_length=12, unique=True)),
+                ("url", models.URLField(max_length=500)),
+                ("attempts", models.PositiveSmallIntegerField(default=0)),
+                ("next_attempt_at", models.DateTimeField(default=django.utils.timezone.now, null=True)),
+                ("last_error", models.TextField(blank=True)),
+            ],
+        ),
+    ]
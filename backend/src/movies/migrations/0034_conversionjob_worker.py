@@ -0,0 +1,22 @@
+# Generated by Django 6.0.5 on 2026-10-18 21:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("movies", "0033_coverdownload"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversionjob",
+            name="heartbeat_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="conversionjob",
+            name="worker",
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
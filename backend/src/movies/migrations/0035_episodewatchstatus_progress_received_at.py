@@ -0,0 +1,17 @@
+# Generated by Django 6.0.5 on 2026-10-18 21:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("movies", "0034_conversionjob_worker"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="episodewatchstatus",
+            name="progress_received_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,13 +1,21 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import logging
+import re
+import shutil
+from datetime import timedelta
 from pathlib import Path
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models.signals import pre_delete
+from django.db import models, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.signals import post_save, pre_delete
 from django.dispatch.dispatcher import receiver
+from django.utils import timezone
+
+from .library_index import library_index
+from .notify import notify
 
 logger = logging.getLogger(__name__)
 
@@ -75,10 +83,23 @@ class Episode(models.Model):
     def converted_video_filename(self) -> Path:
         return self.base_filename(".converted.mp4")
 
+    @property
+    def hls_playlist_filename(self) -> Path:
+        return self.base_filename(".hls.m3u8")
+
     @property
     def cover_filename(self) -> Path:
         return self.base_filename(".jpg", episode_number=False)
 
+    def cover_thumbnail_filename(self, width: int, extension=".webp") -> Path:
+        return self.base_filename(f".{width}w{extension}", episode_number=False)
+
+    def cover_thumbnail_path(self, width: int, extension=".webp") -> Path:
+        return settings.MOVIE_LIBRARY_PATH / self.cover_thumbnail_filename(width, extension)
+
+    def cover_thumbnail_url(self, width: int, extension=".webp") -> str:
+        return f"{settings.MOVIE_LIBRARY_URL}/{self.cover_thumbnail_filename(width, extension)}"
+
     def subtitles_filename(self, extension=".srt", language_code="eng") -> Path:
         return self.base_filename(f".{language_code}{extension}")
 
@@ -90,12 +111,22 @@ class Episode(models.Model):
 
     @property
     def conversion_status(self):
-        if self.temporary_video_path.exists():
-            return self.CONVERTING
-        elif self.converted_video_path.exists():
-            return self.CONVERTED
-        else:
-            return self.NOT_CONVERTED
+        return library_index.conversion_status(self)
+
+    def delete_conversion_work_dirs(self):
+        """
+        Delete the converted segments of this episode's unfinished conversions
+        """
+        if not settings.CONVERSION_WORK_PATH.exists():
+            return
+        # The directories are named after the original video's inode and size
+        work_dir_pattern = re.compile(re.escape(str(self.base_filename())) + r"\.\d+\.\d+")
+        for work_dir in settings.CONVERSION_WORK_PATH.iterdir():
+            if work_dir_pattern.fullmatch(work_dir.name):
+                try:
+                    shutil.rmtree(work_dir)
+                except OSError:
+                    logger.warning(f"Could not delete directory {str(work_dir)}")
 
     def __getattribute__(self, attr) -> Path | str | None:
         try:
@@ -119,6 +150,7 @@ def episode_delete(sender, instance: Episode, **kwargs):
     episode_count = Episode.objects.filter(tmdb_id=instance.tmdb_id).count()
     if episode_count == 1:
         files_to_delete.append(instance.cover_path)
+        files_to_delete.extend(settings.MOVIE_LIBRARY_PATH.glob(str(instance.cover_thumbnail_filename("*", ".*"))))
 
     for path in files_to_delete:
         try:
@@ -126,6 +158,328 @@ def episode_delete(sender, instance: Episode, **kwargs):
         except OSError:
             logger.warning(f"Could not delete file {str(path)}")
 
+    VideoProbe.objects.filter(path__in=[str(path) for path in files_to_delete]).delete()
+    instance.delete_conversion_work_dirs()
+    LibraryVersion.bump()
+
+
+@receiver(post_save, sender=Episode)
+def episode_save(sender, instance: Episode, **kwargs):
+    LibraryVersion.bump()
+
+
+class LibraryVersion(models.Model):
+    """
+    Counter that changes every time the movie library changes. Used to invalidate cached library snapshots.
+    There is only one row.
+    """
+
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Library version {self.version}"
+
+    @classmethod
+    def current(cls) -> int:
+        return cls.objects.filter(pk=1).values_list("version", flat=True).first() or 0
+
+    @classmethod
+    def bump(cls):
+        if not cls.objects.filter(pk=1).update(version=F("version") + 1):
+            cls.objects.get_or_create(pk=1, defaults={"version": 1})
+
+
+class ConversionJob(models.Model):
+    """
+    An episode waiting to be converted, or being converted. Workers claim the job with the highest priority first.
+    """
+
+    PENDING = 0
+    RUNNING = 1
+    DONE = 2
+    FAILED = 3
+
+    state_choices = (
+        (PENDING, "pending"),
+        (RUNNING, "running"),
+        (DONE, "done"),
+        (FAILED, "failed"),
+    )
+
+    plan_choices = (
+        ("remux", "remux"),
+        ("audio", "convert audio"),
+        ("video", "convert video"),
+        ("full", "convert video and audio"),
+    )
+
+    DEFAULT_PRIORITY = 0
+    FIRST_EPISODE_PRIORITY = 10  # Movies and first episodes are more likely to be watched first
+    WATCHING_PRIORITY = 100  # Someone tried to watch the episode
+
+    # Converters update the heartbeat of their running jobs. Jobs without a recent heartbeat belong to a dead converter.
+    HEARTBEAT_INTERVAL = 30  # Seconds
+    STALLED_AFTER = 120  # Seconds
+
+    episode = models.OneToOneField(Episode, on_delete=models.CASCADE, related_name="conversion_job")
+    state = models.SmallIntegerField(default=PENDING, choices=state_choices)
+    priority = models.SmallIntegerField(default=DEFAULT_PRIORITY)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    plan = models.CharField(max_length=10, blank=True, choices=plan_choices)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)  # ffmpeg's stderr output
+
+    # The converter running the job, and the last time it said it was still running it
+    worker = models.CharField(max_length=100, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    # Progress of the running conversion
+    progress = models.FloatField(default=0)  # Percent
+    fps = models.FloatField(default=0)
+    speed = models.FloatField(default=0)  # Seconds of video converted per second
+    progress_updated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["state", "-priority", "created_at"])]
+
+    def __str__(self):
+        return f"Conversion of {self.episode} ({self.get_state_display()})"
+
+    @classmethod
+    def default_priority(cls, episode: Episode) -> int:
+        is_first_episode = episode.media_type == Episode.MOVIE or episode.episode in (None, 1)
+        return cls.FIRST_EPISODE_PRIORITY if is_first_episode else cls.DEFAULT_PRIORITY
+
+    @classmethod
+    def enqueue(cls, episode: Episode, priority: int | None = None) -> "ConversionJob":
+        if priority is None:
+            priority = cls.default_priority(episode)
+
+        job, created = cls.objects.get_or_create(episode=episode, defaults={"priority": priority})
+        if not created:
+            # A running job is left alone. Its worker would overwrite the changes when it's done.
+            cls.objects.filter(pk=job.pk).exclude(state=cls.RUNNING).update(priority=priority, **cls._reset_fields())
+            job.refresh_from_db()
+        transaction.on_commit(lambda: notify(settings.CONVERTER_SOCKET_PATH))
+        return job
+
+    @classmethod
+    def enqueue_many(cls, episodes: list[Episode]):
+        """
+        Same as enqueue(), but with a single query for all episodes
+        """
+        if not episodes:
+            return
+        cls.objects.bulk_create(
+            [cls(episode=episode, priority=cls.default_priority(episode)) for episode in episodes],
+            ignore_conflicts=True,
+        )
+
+        # Reset the existing jobs, except the running ones, like enqueue() does
+        first_episode_ids = [
+            episode.pk for episode in episodes if cls.default_priority(episode) == cls.FIRST_EPISODE_PRIORITY
+        ]
+        cls.objects.filter(episode__in=episodes).exclude(state=cls.RUNNING).update(
+            priority=Case(
+                When(episode_id__in=first_episode_ids, then=Value(cls.FIRST_EPISODE_PRIORITY)),
+                default=Value(cls.DEFAULT_PRIORITY),
+            ),
+            **cls._reset_fields(),
+        )
+        transaction.on_commit(lambda: notify(settings.CONVERTER_SOCKET_PATH))
+
+    @classmethod
+    def _reset_fields(cls) -> dict:
+        return {
+            "state": cls.PENDING,
+            "attempts": 0,
+            "plan": "",
+            "created_at": timezone.now(),
+            "started_at": None,
+            "finished_at": None,
+            "last_error": "",
+            "worker": "",
+            "heartbeat_at": None,
+        }
+
+    @classmethod
+    def enqueue_unconverted(cls) -> int:
+        """
+        Enqueue the episodes that have an original video, but no converted video and no conversion job
+        """
+        enqueued_count = 0
+        for episode in Episode.objects.filter(triage_path__isnull=False, conversion_job__isnull=True):
+            if (
+                library_index.exists(episode.original_video_filename)
+                and episode.conversion_status == Episode.NOT_CONVERTED
+            ):
+                cls.enqueue(episode)
+                enqueued_count += 1
+        return enqueued_count
+
+    @classmethod
+    def prioritize(cls, episode: Episode, priority: int):
+        cls.objects.filter(episode=episode, state=cls.PENDING, priority__lt=priority).update(priority=priority)
+
+    @classmethod
+    def claim(cls, worker: str) -> "ConversionJob | None":
+        """
+        Atomically mark the next pending job as running by this worker, and return it. Returns None if there are no
+        pending jobs.
+        """
+        while True:
+            job = cls.objects.filter(state=cls.PENDING).order_by("-priority", "created_at").first()
+            if job is None:
+                return None
+
+            # Only one worker can move the job out of the PENDING state
+            claimed = cls.objects.filter(pk=job.pk, state=cls.PENDING).update(
+                state=cls.RUNNING,
+                attempts=F("attempts") + 1,
+                worker=worker,
+                started_at=timezone.now(),
+                heartbeat_at=timezone.now(),
+                finished_at=None,
+                progress=0,
+                fps=0,
+                speed=0,
+                progress_updated_at=None,
+            )
+            if claimed:
+                job.refresh_from_db()
+                return job
+
+    @classmethod
+    def heartbeat(cls, worker: str):
+        cls.objects.filter(state=cls.RUNNING, worker=worker).update(heartbeat_at=timezone.now())
+
+    @classmethod
+    def reclaim_stalled(cls, dead_worker: str | None = None) -> int:
+        """
+        Put the jobs of dead converters back in the queue, or mark them as failed if they reached the maximum number
+        of attempts. The jobs of dead_worker are reclaimed even if their heartbeat is recent.
+        """
+        stalled_before = timezone.now() - timedelta(seconds=cls.STALLED_AFTER)
+        is_stalled = models.Q(heartbeat_at__lt=stalled_before) | models.Q(
+            heartbeat_at__isnull=True, started_at__lt=stalled_before
+        )
+        if dead_worker:
+            is_stalled |= models.Q(worker=dead_worker)
+
+        # A job that keeps killing its converter, for example by running out of memory, is not retried forever
+        return cls.objects.filter(is_stalled, state=cls.RUNNING).update(
+            state=Case(
+                When(attempts__gte=settings.CONVERSION_MAX_ATTEMPTS, then=Value(cls.FAILED)),
+                default=Value(cls.PENDING),
+            ),
+            finished_at=timezone.now(),
+            last_error="The converter stopped during the conversion",
+            worker="",
+            heartbeat_at=None,
+        )
+
+    @property
+    def eta(self) -> int | None:
+        """
+        Seconds until the conversion is done
+        """
+        if self.state != self.RUNNING or not self.speed or not self.episode.duration:
+            return None
+        remaining_duration = self.episode.duration * (100 - self.progress) / 100
+        return round(remaining_duration / self.speed)
+
+    @property
+    def is_stalled(self) -> bool:
+        last_sign_of_life = self.heartbeat_at or self.started_at
+        return (
+            self.state == self.RUNNING
+            and last_sign_of_life is not None
+            and (timezone.now() - last_sign_of_life).total_seconds() > self.STALLED_AFTER
+        )
+
+    def _update_if_running(self, **fields) -> bool:
+        """
+        Update the job, unless it was taken away from this worker in the meantime
+        """
+        updated = ConversionJob.objects.filter(pk=self.pk, state=self.RUNNING, worker=self.worker).update(**fields)
+        for name, value in fields.items():
+            setattr(self, name, value)
+        return bool(updated)
+
+    def set_progress(self, progress: float, fps: float, speed: float):
+        self._update_if_running(progress=progress, fps=fps, speed=speed, progress_updated_at=timezone.now())
+
+    def succeed(self):
+        self._update_if_running(state=self.DONE, finished_at=timezone.now(), last_error="")
+
+    def fail(self, error: str):
+        state = self.FAILED if self.attempts >= settings.CONVERSION_MAX_ATTEMPTS else self.PENDING
+        updated = self._update_if_running(state=state, finished_at=timezone.now(), last_error=error[-10_000:])
+        if updated and state == self.FAILED:
+            self.episode.delete_conversion_work_dirs()  # There won't be another attempt to resume
+
+    def release(self):
+        """
+        Put the job back in the queue without counting it as an attempt
+        """
+        self._update_if_running(state=self.PENDING, attempts=self.attempts - 1, worker="", heartbeat_at=None)
+
+
+class CoverDownload(models.Model):
+    """
+    A movie cover to download. Covers are downloaded in the background by the download_covers command, and the row is
+    deleted once the cover is downloaded.
+    """
+
+    MAX_ATTEMPTS = 5
+
+    tmdb_id = models.CharField(max_length=12, unique=True)
+    url = models.URLField(max_length=500)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now, null=True)  # None after the last failed attempt
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"Cover of {self.tmdb_id}"
+
+    @classmethod
+    def enqueue(cls, tmdb_id: str, url: str):
+        cls.objects.update_or_create(
+            tmdb_id=tmdb_id,
+            defaults={"url": url, "attempts": 0, "next_attempt_at": timezone.now(), "last_error": ""},
+        )
+        transaction.on_commit(lambda: notify(settings.COVER_DOWNLOADER_SOCKET_PATH))
+
+    def fail(self, error: str):
+        """
+        Retry later, waiting longer after each failed attempt
+        """
+        self.attempts += 1
+        self.last_error = error
+        if self.attempts >= self.MAX_ATTEMPTS:
+            self.next_attempt_at = None
+        else:
+            self.next_attempt_at = timezone.now() + timedelta(minutes=2**self.attempts)
+        self.save()
+
+
+class VideoProbe(models.Model):
+    """
+    Cached ffprobe output. It's only valid if the file's size, mtime and inode did not change.
+    """
+
+    path = models.CharField(max_length=500, unique=True)
+    size = models.PositiveBigIntegerField()
+    mtime_ns = models.PositiveBigIntegerField()
+    inode = models.PositiveBigIntegerField()
+    metadata = models.JSONField()
+    probed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.path
+
 
 class IgnoredTriageFile(models.Model):
     path = models.CharField(max_length=300, unique=True)
@@ -134,11 +488,51 @@ class IgnoredTriageFile(models.Model):
         return self.path
 
 
+class TriageDirectory(models.Model):
+    """
+    A directory in the triage directory. Its files are only listed again when its mtime changes.
+    """
+
+    path = models.CharField(max_length=500, unique=True)
+    parent = models.ForeignKey("self", on_delete=models.CASCADE, null=True, related_name="subdirectories")
+    mtime_ns = models.BigIntegerField(null=True)  # None until the directory is listed
+
+    class Meta:
+        verbose_name_plural = "triage directories"
+
+    def __str__(self):
+        return self.path
+
+
+class TriageFile(models.Model):
+    """
+    A video or subtitles file in the triage directory. The title suggestions are parsed from the file name once.
+    """
+
+    VIDEO = 1
+    SUBTITLES = 2
+    kind_choices = (
+        (VIDEO, "video"),
+        (SUBTITLES, "subtitles"),
+    )
+
+    path = models.CharField(max_length=500, unique=True)
+    directory = models.ForeignKey(TriageDirectory, on_delete=models.CASCADE, related_name="files")
+    kind = models.PositiveSmallIntegerField(choices=kind_choices)
+    parsed_name = models.JSONField(default=dict)  # Title, season and episode parsed from the file name
+
+    def __str__(self):
+        return self.path
+
+
 class EpisodeWatchStatus(models.Model):
     episode = models.ForeignKey(Episode, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     stopped_at = models.PositiveIntegerField(default=0)
     last_watched = models.DateField(default=None, blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # For ?since= requests
+    # When the server received stopped_at. Buffered progress that was received earlier is not saved.
+    progress_received_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return "{} for user {}".format(self.episode.title, self.user)
@@ -150,6 +544,7 @@ class EpisodeWatchStatus(models.Model):
 class StarredMovie(models.Model):
     tmdb_id = models.CharField(max_length=12, null=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return "{} for user {}".format(self.tmdb_id, self.user)
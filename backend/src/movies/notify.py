@@ -0,0 +1,56 @@
+import logging
+import select
+import socket
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def notify(socket_path: Path):
+    """
+    Wake up the process listening on socket_path. Does nothing if no process is listening.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.setblocking(False)
+        try:
+            sock.sendto(b"1", str(socket_path))
+        except (FileNotFoundError, ConnectionRefusedError, BlockingIOError):
+            pass  # Not listening, or already has pending notifications
+
+
+class NotificationListener:
+    """
+    Receives notifications sent with notify(). Notifications sent while the listener is busy are not lost; the next
+    call to wait() returns immediately.
+    """
+
+    def __init__(self, socket_path: Path):
+        self.socket_path = socket_path
+        self.socket: socket.socket | None = None
+
+    def __enter__(self):
+        self.socket_path.unlink(missing_ok=True)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.bind(str(self.socket_path))
+        self.socket.setblocking(False)
+        return self
+
+    def __exit__(self, *args):
+        self.socket.close()
+        self.socket_path.unlink(missing_ok=True)
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Wait until a notification is received, or until the timeout expires. Returns False on timeout.
+        """
+        readable, _, _ = select.select([self.socket], [], [], timeout)
+        if not readable:
+            return False
+
+        # Several notifications can arrive at once
+        try:
+            while self.socket.recv(16):
+                pass
+        except BlockingIOError:
+            pass
+        return True
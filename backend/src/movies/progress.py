@@ -0,0 +1,129 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime
+
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import Episode, EpisodeWatchStatus
+
+logger = logging.getLogger(__name__)
+
+flush_interval = 5  # Seconds
+
+
+class ProgressBuffer:
+    """
+    Collects playback progress updates in memory, and saves them in bulk every `flush_interval` seconds. Only the
+    latest progress of each (user, episode) is saved.
+
+    Each gunicorn worker has its own buffer. Updates are ordered by the time the server received them. When they are
+    saved, updates that were received before the saved progress are skipped. This way, a worker that flushes late
+    can't overwrite newer progress from another worker, or progress that was reset in the meantime.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending: dict[tuple[int, int], tuple[int, datetime]] = {}  # (user, episode) -> (progress, received at)
+        self.flush_thread: threading.Thread | None = None
+
+    def add(self, user_id: int, episode_id: int, progress: int) -> bool:
+        """
+        Queue a progress update. Returns False if the update was dropped because it does not change the pending
+        progress.
+        """
+        key = (user_id, episode_id)
+        with self.lock:
+            pending = self.pending.get(key)
+            if pending and pending[0] == progress:
+                return False
+            self.pending[key] = (progress, timezone.now())
+            self.start_flush_thread()
+        return True
+
+    def forget(self, user_id: int, episode_id: int):
+        """
+        Drop the pending progress, for example when the progress was reset in the database. The other workers skip
+        their pending progress when they see that the progress was reset after they received it.
+        """
+        with self.lock:
+            self.pending.pop((user_id, episode_id), None)
+
+    def flush(self):
+        with self.lock:
+            updates, self.pending = self.pending, {}
+        if not updates:
+            return
+
+        try:
+            # Transactions take the write lock when they start, so the progress can't change between the read and the
+            # write.
+            with transaction.atomic():
+                saved_watch_statuses = {
+                    (watch_status.user_id, watch_status.episode_id): watch_status
+                    for watch_status in EpisodeWatchStatus.objects.filter(
+                        user_id__in={user_id for user_id, episode_id in updates},
+                        episode_id__in={episode_id for user_id, episode_id in updates},
+                    ).only("user_id", "episode_id", "stopped_at", "progress_received_at")
+                }
+
+                # Episodes can be deleted while their progress is buffered
+                episode_ids = {episode_id for user_id, episode_id in updates}
+                existing_episode_ids = set(Episode.objects.filter(pk__in=episode_ids).values_list("pk", flat=True))
+                watch_statuses = []
+                unchanged_watch_statuses = []
+                for (user_id, episode_id), (progress, received_at) in updates.items():
+                    saved = saved_watch_statuses.get((user_id, episode_id))
+                    if episode_id not in existing_episode_ids:
+                        continue
+                    if saved and saved.progress_received_at and received_at <= saved.progress_received_at:
+                        continue
+                    if saved and saved.progress_received_at and saved.stopped_at == progress:
+                        # A paused video sends the same progress again and again. Only the time it was received
+                        # changes, so the watch status does not look recently updated.
+                        saved.progress_received_at = received_at
+                        unchanged_watch_statuses.append(saved)
+                        continue
+                    watch_statuses.append(
+                        EpisodeWatchStatus(
+                            user_id=user_id,
+                            episode_id=episode_id,
+                            stopped_at=progress,
+                            progress_received_at=received_at,
+                        )
+                    )
+                EpisodeWatchStatus.objects.bulk_create(
+                    watch_statuses,
+                    update_conflicts=True,
+                    unique_fields=["episode", "user"],
+                    update_fields=["stopped_at", "progress_received_at", "updated_at"],
+                )
+                EpisodeWatchStatus.objects.bulk_update(unchanged_watch_statuses, ["progress_received_at"])
+        except:
+            # Try again on the next flush, unless there are newer updates
+            with self.lock:
+                for key, update in updates.items():
+                    self.pending.setdefault(key, update)
+            raise
+
+        logger.debug(f"Saved {len(watch_statuses)} of {len(updates)} progress updates")
+
+    def start_flush_thread(self):
+        if self.flush_thread is None:
+            self.flush_thread = threading.Thread(target=self.flush_periodically, name="progress-flush", daemon=True)
+            self.flush_thread.start()
+            atexit.register(self.flush)
+
+    def flush_periodically(self):
+        while True:
+            time.sleep(flush_interval)
+            try:
+                close_old_connections()
+                self.flush()
+            except:
+                logger.exception("Could not save progress updates")
+
+
+progress_buffer = ProgressBuffer()
@@ -0,0 +1,114 @@
+import logging
+import os
+from functools import lru_cache
+from pathlib import Path
+
+import PTN
+from django.conf import settings
+from django.db import transaction
+
+from .models import TriageDirectory, TriageFile
+
+logger = logging.getLogger(__name__)
+
+parse_cache_size = 10_000  # Parsed file names kept in memory
+
+
+def get_triage_file_kind(filename: str) -> int | None:
+    path = Path(filename)
+    if path.suffix.lower() in settings.VIDEO_EXTENSIONS and not path.stem.lower().endswith("sample"):
+        return TriageFile.VIDEO
+    elif path.suffix.lower() in settings.SUBTITLE_EXTENSIONS:
+        return TriageFile.SUBTITLES
+    return None
+
+
+def parse_name(filename: str) -> dict:
+    """
+    Parses the title, season and episode from a torrent file name
+    """
+    return dict(parse_name_cached(filename))  # A copy, so that callers can't change the cached value
+
+
+@lru_cache(maxsize=parse_cache_size)
+def parse_name_cached(filename: str) -> dict:
+    # PTN runs dozens of regexes on each name
+    parsed_name = PTN.parse(filename)
+    return {
+        "title": parsed_name.get("title"),
+        "season": parsed_name.get("season"),
+        "episode": parsed_name.get("episode"),
+    }
+
+
+def update_triage_directory(directory: TriageDirectory, mtime_ns: int) -> list[str]:
+    """
+    Lists a directory that changed, and updates its files in the index. Returns the paths of its subdirectories.
+    """
+    subdirectory_paths = []
+    file_kinds = {}
+    with os.scandir(directory.path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirectory_paths.append(entry.path)
+            elif entry.is_file() and (kind := get_triage_file_kind(entry.name)):
+                file_kinds[entry.path] = kind
+
+    indexed_paths = set(directory.files.values_list("path", flat=True))
+    with transaction.atomic():
+        TriageFile.objects.filter(path__in=indexed_paths - file_kinds.keys()).delete()
+        TriageFile.objects.bulk_create(
+            [
+                TriageFile(path=path, directory=directory, kind=kind, parsed_name=parse_name(Path(path).name))
+                for path, kind in file_kinds.items()
+                if path not in indexed_paths
+            ],
+            ignore_conflicts=True,  # Another request indexed it at the same time
+        )
+        directory.mtime_ns = mtime_ns
+        directory.save(update_fields=["mtime_ns"])
+    return subdirectory_paths
+
+
+def update_triage_index():
+    """
+    Updates the index of files in the triage directory. Adding, removing or renaming a file changes the mtime of its
+    directory, so only the directories with a new mtime are listed again. The other directories only need a stat().
+    """
+    directories = {d.path: d for d in TriageDirectory.objects.all()}
+    subdirectory_paths: dict[int, list[str]] = {}
+    for directory in directories.values():
+        subdirectory_paths.setdefault(directory.parent_id, []).append(directory.path)
+
+    existing_paths = set()
+    listed_count = 0
+    paths_to_check: list[tuple[str, TriageDirectory | None]] = [(str(settings.TRIAGE_PATH), None)]
+    while paths_to_check:
+        path, parent = paths_to_check.pop()
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            continue
+        existing_paths.add(path)
+
+        directory = directories.get(path)
+        if directory is None:
+            directory = TriageDirectory.objects.get_or_create(path=path, defaults={"parent": parent})[0]
+
+        if directory.mtime_ns == mtime_ns:
+            children = subdirectory_paths.get(directory.pk, [])
+        else:
+            children = update_triage_directory(directory, mtime_ns)
+            listed_count += 1
+        paths_to_check.extend((child, directory) for child in children)
+
+    # Also removes the subdirectories and files of deleted directories
+    deleted_directories = [d.pk for p, d in directories.items() if p not in existing_paths]
+    if deleted_directories:
+        TriageDirectory.objects.filter(pk__in=deleted_directories).delete()
+
+    if listed_count or deleted_directories:
+        logger.info(
+            f"Updated triage index: listed {listed_count} changed directories, "
+            f"removed {len(deleted_directories)} deleted directories"
+        )
@@ -1,70 +1,67 @@
 import datetime
 import json
 import logging
+import time
 from pathlib import Path
 
-import PTN
-import requests
 from django.conf import settings
 from django.contrib.auth.mixins import PermissionRequiredMixin
+from django.core.paginator import Paginator
 from django.db import transaction
-from django.http import JsonResponse
+from django.db.models import Exists, OuterRef
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse
+from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag
 from django.views import View
 
-from .models import Episode, EpisodeWatchStatus, IgnoredTriageFile, StarredMovie
+from .importer import import_episodes
+from .library import get_library_snapshot
+from .progress import progress_buffer
+from .models import (
+    ConversionJob,
+    CoverDownload,
+    Episode,
+    EpisodeWatchStatus,
+    IgnoredTriageFile,
+    LibraryVersion,
+    StarredMovie,
+    TriageFile,
+)
+from .triage import parse_name, update_triage_index
 
 logger = logging.getLogger(__name__)
 
+# updated_at is set before the write commits, and a write can wait for the database lock. Changes saved during that
+# time would have an updated_at before the returned timestamp, so ?since= requests look back a bit further.
+user_state_since_margin = datetime.timedelta(seconds=30)
+
 
 class MovieListView(View):
     def get(self, request, *args, **kwargs):
         """
-        Return all movies/shows and their episodes as a nested list
+        Return all movies/shows and their episodes as a nested list. The list is the same for all users, so that it
+        can be cached. User-specific data comes from MovieUserStateView.
         """
-        episodes_by_tmdb_id = {}
-
-        watch_statuses = {wp.episode_id: wp for wp in EpisodeWatchStatus.objects.filter(user=request.user)}
-        starred_movies = {s.tmdb_id: s for s in StarredMovie.objects.filter(user=request.user)}
-
-        for episode in Episode.objects.all():
-            if not episodes_by_tmdb_id.get(episode.tmdb_id):
-                episodes_by_tmdb_id[episode.tmdb_id] = []
-            episodes_by_tmdb_id[episode.tmdb_id].append(episode)
-
-        json_movies = []
-        for tmdb_id, episodes in episodes_by_tmdb_id.items():
-            movie_or_show = {
-                "tmdbId": tmdb_id,
-                "mediaType": episodes[0].media_type,
-                "title": episodes[0].title,
-                "description": episodes[0].description,
-                "coverUrl": episodes[0].cover_url,
-                "episodes": [],
-                "isStarred": tmdb_id in starred_movies,
-            }
-
-            for episode in episodes:
-                watch_status = watch_statuses.get(episode.pk)
-                movie_or_show["episodes"].append(
-                    {
-                        "conversionStatus": episode.conversion_status,
-                        "dateAdded": episode.date_added,
-                        "duration": episode.duration,
-                        "id": episode.id,
-                        "lastWatched": watch_status.last_watched if watch_status else None,
-                        "originalVideoUrl": episode.original_video_url,
-                        "season": episode.season,
-                        "episode": episode.episode,
-                        "progress": watch_status.stopped_at if watch_status else 0,
-                        "releaseYear": episode.release_year,
-                        "hasOriginalVersion": episode.original_video_path.exists(),
-                        "hasSubtitles": episode.subtitles_path(".vtt", "eng").exists(),
-                    }
-                )
-
-            json_movies.append(movie_or_show)
-
-        return JsonResponse({"movies": json_movies})
+        snapshot = get_library_snapshot()
+
+        # The gzipped and the plain body are different representations, so they can't share a strong ETag
+        use_gzip = "gzip" in request.headers.get("Accept-Encoding", "")
+        etag = quote_etag(f"{snapshot.version}-gzip" if use_gzip else snapshot.version)
+        headers = {
+            "ETag": etag,
+            "Cache-Control": "public, no-cache",
+            "Vary": "Accept-Encoding",
+        }
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            return HttpResponseNotModified(headers=headers)
+
+        if use_gzip:
+            return HttpResponse(
+                snapshot.gzipped_json,
+                content_type="application/json",
+                headers={**headers, "Content-Encoding": "gzip"},
+            )
+        return HttpResponse(snapshot.json, content_type="application/json", headers=headers)
 
     def post(self, request, *args, **kwargs):
         """
@@ -81,103 +78,52 @@ class MovieListView(View):
 
         payload = json.loads(request.body)
 
+        started_at = time.monotonic()
         with transaction.atomic():
-            # Create the episodes
-            episodes: list[Episode] = []
-            for json_episode in payload.get("episodes", []):
-                episode = Episode.objects.get_or_create(
-                    tmdb_id=payload.get("tmdbId"),
-                    episode=json_episode.get("episode", None),
-                    season=json_episode.get("season", None),
-                    media_type=payload.get("mediaType", Episode.MOVIE),
-                )[0]
-
-                if payload.get("title"):
-                    episode.title = payload.get("title")
-                if payload.get("description"):
-                    episode.description = payload.get("description")
-                if "dateAdded" in json_episode:
-                    episode.date_added = json_episode.get("dateAdded")
-
-                if "progress" in json_episode or "lastWatched" in json_episode:
-                    watch_status = EpisodeWatchStatus.objects.get_or_create(user=request.user, episode=episode)[0]
-                    if "progress" in json_episode:
-                        watch_status.stopped_at = json_episode.get("progress", 0)
-                    if "lastWatched" in json_episode:
-                        watch_status.last_watched = json_episode.get("lastWatched")
-                    watch_status.save()
-                if json_episode.get("releaseYear"):
-                    episode.release_year = json_episode.get("releaseYear")
-
-                episodes.append(episode)
-                episode.save()
-
-            # Retrieve the (optional) triage options
-            triage_options = [
-                json_episode.get(
-                    "triage",
-                    {
-                        "movieFile": None,
-                        "subtitlesFileEn": None,
-                        "subtitlesFileFr": None,
-                        "subtitlesFileDe": None,
-                    },
-                )
-                for json_episode in payload.get("episodes", [])
-            ]
+            episodes = import_episodes(payload, request.user)
 
-            # Create hard links to the files in the triage directory so that they can be
-            # in the triage directory and in the movie library at the same time.
-            # If the movie is already in the library, overwrite the file.
-            conversion_queue = []
-            for episode, triage_options in zip(episodes, triage_options):
-                episode_triage_path = settings.TRIAGE_PATH / Path(triage_options.get("movieFile"))
-
-                # Create hard link to the original video in the movie library
-                if episode_triage_path.exists():
-                    episode.triage_path = episode_triage_path
-
-                    # If it replaces an existing episode
-                    episode.original_video_path.unlink(missing_ok=True)
-                    episode.original_video_path.hardlink_to(episode.triage_path)
-                    episode.converted_video_path.unlink(missing_ok=True)
-                    episode.save()
-
-                # Create hard link to subtitle files in the movie library
-                for json_language, sub_language in (
-                    ("En", "eng"),
-                    ("De", "ger"),
-                    ("Fr", "fre"),
-                ):
-                    if not triage_options.get(f"subtitlesFile{json_language}"):
-                        continue
-
-                    subtitles_triage_path = settings.TRIAGE_PATH / triage_options[f"subtitlesFile{json_language}"]
-                    assert subtitles_triage_path.exists()
-
-                    subtitles_original_video_path: Path = episode.subtitles_path(".srt", sub_language)
-                    logger.info(f'Copying subtitles "{subtitles_triage_path!s}" to "{subtitles_original_video_path!s}"')
-                    subtitles_original_video_path.unlink(missing_ok=True)
-                    subtitles_original_video_path.hardlink_to(subtitles_triage_path)
-                    IgnoredTriageFile.objects.get_or_create(path=str(subtitles_triage_path))
-
-                conversion_queue.append(episode)
-
-            # Download the cover URL if necessary
-            new_cover_url = payload.get("coverUrl")
-            if new_cover_url and new_cover_url != episodes[0].cover_url:
-                self.download_file(new_cover_url, episodes[0].cover_path)
+            # Downloaded in the background by the download_covers command
+            if payload.get("coverUrl") and episodes:
+                CoverDownload.enqueue(episodes[0].tmdb_id, payload["coverUrl"])
 
-        return JsonResponse({"result": "success"})
+        import_duration = time.monotonic() - started_at
+        logger.info(f"Imported {len(episodes)} episodes of {payload.get('title')} in {import_duration:.3f} seconds")
+        return JsonResponse({"result": "success", "importedEpisodes": len(episodes), "duration": import_duration})
 
-    def download_file(self, url: str, filename: Path):
-        req = requests.get(url, stream=True)
-        if req.status_code == 200:
-            with filename.open("wb") as cover_file:
-                for chunk in req:
-                    cover_file.write(chunk)
-        else:
-            logger.error(f"Could not download file at {url}.")
+
+class MovieUserStateView(View):
+    def get(self, request, *args, **kwargs):
+        """
+        Return the user's watch progress and starred movies. With ?since=<unix timestamp>, only return the watch
+        progress that changed since then. Starred movies are always returned in full, so that unstarred movies are
+        also removed. The same changes can be returned more than once.
+        """
+        timestamp = timezone.now() - user_state_since_margin
+
+        watch_statuses = EpisodeWatchStatus.objects.filter(user=request.user)
+        if request.GET.get("since"):
+            try:
+                since = datetime.datetime.fromtimestamp(float(request.GET["since"]), tz=datetime.timezone.utc)
+            except (ValueError, OverflowError):
+                return JsonResponse({"result": "failure", "message": "`since` must be a timestamp"}, status=400)
+            watch_statuses = watch_statuses.filter(updated_at__gte=since)
+
+        return JsonResponse(
+            {
+                "timestamp": timestamp.timestamp(),
+                "watchStatuses": [
+                    {
+                        "episodeId": episode_id,
+                        "progress": stopped_at,
+                        "lastWatched": last_watched,
+                    }
+                    for episode_id, stopped_at, last_watched in watch_statuses.values_list(
+                        "episode_id", "stopped_at", "last_watched"
+                    )
+                ],
+                "starredMovies": list(StarredMovie.objects.filter(user=request.user).values_list("tmdb_id", flat=True)),
+            }
+        )
 
 
 class DeleteOriginalVideoView(PermissionRequiredMixin, View):
@@ -191,6 +137,7 @@ class DeleteOriginalVideoView(PermissionRequiredMixin, View):
         try:
             episode = Episode.objects.get(pk=episode_id)
             episode.original_video_path.unlink(missing_ok=True)
+            LibraryVersion.bump()
         except Episode.DoesNotExist:
             message = "Episode does not exist."
             logger.error(f"Failed to replace original of episode #{episode_id}. {message}")
@@ -223,57 +170,83 @@ class EpisodeView(PermissionRequiredMixin, View):
 
 class TriageListView(PermissionRequiredMixin, View):
     """
-    List of untriaged video and subtitle files
+    List of untriaged video and subtitle files. Use ?page= to get the videos one page at a time.
     """
 
     permission_required = "authentication.movies_manage"
+    page_size = 100
 
     def get(self, request, *args, **kwargs):
-        files_in_triage_dir = set(settings.TRIAGE_PATH.rglob("*"))
+        update_triage_index()
 
-        videos_in_triage_dir = {
-            f
-            for f in files_in_triage_dir
-            if f.suffix.lower() in settings.VIDEO_EXTENSIONS and not f.stem.lower().endswith("sample")
-        }
+        # Remove ignored paths that no longer exist
+        IgnoredTriageFile.objects.exclude(path__in=TriageFile.objects.values("path")).delete()
+
+        is_ignored = Exists(IgnoredTriageFile.objects.filter(path=OuterRef("path")))
+        videos = (
+            TriageFile.objects.filter(kind=TriageFile.VIDEO)
+            .exclude(path__in=Episode.objects.exclude(triage_path=None).values("triage_path"))
+            .annotate(ignored=is_ignored)
+            .order_by("ignored", "path")
+        )
+        subtitles = TriageFile.objects.filter(kind=TriageFile.SUBTITLES).exclude(is_ignored).order_by("path")
 
-        triaged_paths = {
-            Path(f) for f in Episode.objects.exclude(triage_path=None).values_list("triage_path", flat=True)
-        }
+        def serialize_triage_item(f):
+            return {
+                "suggestedTitle": f.parsed_name.get("title"),
+                "suggestedSeason": f.parsed_name.get("season"),
+                "suggestedEpisode": f.parsed_name.get("episode"),
+                "path": str(Path(f.path).relative_to(settings.TRIAGE_PATH)),
+                "ignored": f.ignored,
+            }
 
-        ignored_paths = {Path(f) for f in IgnoredTriageFile.objects.values_list("path", flat=True)}
+        response = {
+            "subtitles": [str(Path(f.path).relative_to(settings.TRIAGE_PATH)) for f in subtitles],
+        }
+        if "page" in request.GET:
+            page = Paginator(videos, self.page_size).get_page(request.GET["page"])
+            response["movies"] = [serialize_triage_item(f) for f in page]
+            response["pagination"] = {
+                "page": page.number,
+                "pageCount": page.paginator.num_pages,
+                "count": page.paginator.count,
+            }
+        else:
+            response["movies"] = [serialize_triage_item(f) for f in videos]
+        return JsonResponse(response)
 
-        # Remove ignored paths that no longer exist
-        stale_ignored_paths = ignored_paths - files_in_triage_dir
-        if stale_ignored_paths:
-            IgnoredTriageFile.objects.filter(path__in=[str(p) for p in stale_ignored_paths]).delete()
 
-        videos_to_triage = videos_in_triage_dir - triaged_paths - ignored_paths
-        ignored_videos = videos_in_triage_dir & ignored_paths
+class TriageParseView(PermissionRequiredMixin, View):
+    """
+    Parse the title, season and episode of many file names at once
+    """
 
-        subtitles_in_triage_dir = [
-            str(f.relative_to(settings.TRIAGE_PATH))
-            for f in files_in_triage_dir
-            if f.suffix.lower() in settings.SUBTITLE_EXTENSIONS and f not in ignored_paths
-        ]
+    permission_required = "authentication.movies_manage"
+    max_names = 1000
 
-        def serialize_triage_item(f, ignored):
-            parsed_title = PTN.parse(f.name)
-            return {
-                "suggestedTitle": parsed_title.get("title"),
-                "suggestedSeason": parsed_title.get("season"),
-                "suggestedEpisode": parsed_title.get("episode"),
-                "path": str(f.relative_to(settings.TRIAGE_PATH)),
-                "ignored": ignored,
-            }
+    def post(self, request, *args, **kwargs):
+        try:
+            names = json.loads(request.body)["names"]
+            assert isinstance(names, list) and all(isinstance(name, str) for name in names)
+        except (ValueError, KeyError, AssertionError):
+            return JsonResponse({"result": "failure", "message": "Expected a list of names"}, status=400)
+        if len(names) > self.max_names:
+            return JsonResponse(
+                {"result": "failure", "message": f"Cannot parse more than {self.max_names} names at once"}, status=400
+            )
 
-        return JsonResponse(
-            {
-                "movies": [serialize_triage_item(f, False) for f in sorted(videos_to_triage)]
-                + [serialize_triage_item(f, True) for f in sorted(ignored_videos)],
-                "subtitles": sorted(subtitles_in_triage_dir),
-            }
-        )
+        results = []
+        for name in names:
+            parsed_name = parse_name(name)
+            results.append(
+                {
+                    "name": name,
+                    "suggestedTitle": parsed_name["title"],
+                    "suggestedSeason": parsed_name["season"],
+                    "suggestedEpisode": parsed_name["episode"],
+                }
+            )
+        return JsonResponse({"results": results})
 
 
 class TriageIgnoreView(PermissionRequiredMixin, View):
@@ -324,6 +297,44 @@ class SystemStatsView(PermissionRequiredMixin, View):
         )
 
 
+class ConversionStatusView(PermissionRequiredMixin, View):
+    permission_required = "authentication.movies_manage"
+
+    def get(self, request, *args, **kwargs):
+        """
+        The conversion queue, with the progress and speed of the running conversions
+        """
+        states = (ConversionJob.RUNNING, ConversionJob.PENDING, ConversionJob.FAILED)
+        jobs = sorted(
+            ConversionJob.objects.filter(state__in=states)
+            .select_related("episode")
+            .order_by("-priority", "created_at"),
+            key=lambda job: states.index(job.state),
+        )
+        return JsonResponse(
+            {
+                "conversions": [
+                    {
+                        "episodeId": job.episode_id,
+                        "title": str(job.episode),
+                        "state": job.get_state_display(),
+                        "plan": job.plan,
+                        "priority": job.priority,
+                        "attempts": job.attempts,
+                        "startedAt": job.started_at,
+                        "progress": round(job.progress, 1),
+                        "fps": job.fps,
+                        "speed": job.speed,
+                        "eta": job.eta,
+                        "progressUpdatedAt": job.progress_updated_at,
+                        "isStalled": job.is_stalled,
+                    }
+                    for job in jobs
+                ]
+            }
+        )
+
+
 class EpisodeWatchedView(View):
     def post(self, request, *args, **kwargs):
         episode_id = kwargs.get("id")
@@ -342,8 +353,13 @@ class EpisodeUnwatchedView(View):
         episode_id = kwargs.get("id")
         try:
             episode = Episode.objects.get(pk=episode_id)
+            # Reset instead of deleting, so that ?since= requests see the change
+            progress_buffer.forget(request.user.pk, episode.pk)
             watch_status = EpisodeWatchStatus.objects.get(user=request.user, episode=episode)
-            watch_status.delete()
+            watch_status.stopped_at = 0
+            watch_status.progress_received_at = timezone.now()  # Other workers skip their older buffered progress
+            watch_status.last_watched = None
+            watch_status.save()
         except EpisodeWatchStatus.DoesNotExist:
             pass
         except Episode.DoesNotExist:
@@ -351,6 +367,22 @@ class EpisodeUnwatchedView(View):
         return JsonResponse({"result": "success"})
 
 
+class EpisodePrioritizeConversionView(PermissionRequiredMixin, View):
+    permission_required = "authentication.movies_manage"
+
+    def post(self, request, *args, **kwargs):
+        """
+        Someone is trying to watch an episode that is not converted yet. Convert it before the others.
+        """
+        episode_id = kwargs.get("id")
+        try:
+            episode = Episode.objects.get(pk=episode_id)
+            ConversionJob.prioritize(episode, ConversionJob.WATCHING_PRIORITY)
+        except Episode.DoesNotExist:
+            return JsonResponse({"result": "failure", "message": "Episode does not exist"}, status=404)
+        return JsonResponse({"result": "success"})
+
+
 class EpisodeStarView(View):
     def post(self, request, *args, **kwargs):
         episode_id = kwargs.get("id")
@@ -381,12 +413,10 @@ class EpisodeProgressView(View):
         episode_id = kwargs.get("id")
         payload = json.loads(request.body)
         try:
-            episode = Episode.objects.get(pk=episode_id)
-            watch_status = EpisodeWatchStatus.objects.get_or_create(user=request.user, episode=episode)[0]
-            watch_status.stopped_at = int(payload["progress"])
-            watch_status.save()
-        except Episode.DoesNotExist:
-            return JsonResponse({"result": "failure", "message": "Episode does not exist"}, status=404)
+            progress = int(payload["progress"])
+            if not Episode.objects.filter(pk=episode_id).exists():
+                return JsonResponse({"result": "failure", "message": "Episode does not exist"}, status=404)
+            progress_buffer.add(request.user.pk, episode_id, progress)
         except KeyError:
             return JsonResponse(
                 {
@@ -401,3 +431,32 @@ class EpisodeProgressView(View):
                 status=400,
             )
         return JsonResponse({"result": "success"})
+
+
+class EpisodeProgressBatchView(View):
+    def post(self, request, *args, **kwargs):
+        """
+        Save the progress of many episodes at once. Expects {"updates": [{"episodeId", "progress", "timestamp"}]}, where
+        timestamp is the unix time when the progress was recorded. The client's clock can be different from the server's
+        clock, so timestamps are only used to order the updates in the batch. The batch counts as newer than the
+        updates the server received before it.
+        """
+        try:
+            updates = [
+                (int(update["episodeId"]), int(update["progress"]), float(update.get("timestamp") or 0))
+                for update in json.loads(request.body)["updates"]
+            ]
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse(
+                {"result": "failure", "message": "Expected a list of updates with an episodeId and a progress"},
+                status=400,
+            )
+
+        existing_episode_ids = set(
+            Episode.objects.filter(pk__in={episode_id for episode_id, _, _ in updates}).values_list("pk", flat=True)
+        )
+        accepted_count = 0
+        for episode_id, progress, timestamp in sorted(updates, key=lambda update: update[2]):
+            if episode_id in existing_episode_ids and progress_buffer.add(request.user.pk, episode_id, progress):
+                accepted_count += 1
+        return JsonResponse({"result": "success", "accepted": accepted_count, "dropped": len(updates) - accepted_count})
@@ -64,6 +64,11 @@ export default Vue.component('episode', {
     this.movie = await this.$store.dispatch('movies/getMovie', this.$route.params.tmdbId);
     this.episode = this.movie.episodeMap[this.$route.params.episodeId];
 
+    const isAdmin = (await this.$store.dispatch('users/getUserSettings')).isAdmin;
+    if (isAdmin && !this.episode.isConverted) {
+      MoviesService.prioritizeConversion(this.episode.id);
+    }
+
     MoviesService.subtitlesExist(this.episode, 'vtt').then(availableSubtitles => {
       this.subtitlesExistEn = availableSubtitles.en;
       this.subtitlesExistFr = availableSubtitles.fr;
@@ -114,6 +119,7 @@ export default Vue.component('episode', {
     <div v-if="episode" class="container">
       <h2>{{ fullTitle }}</h2>
       <video ref="videoElement" controls autoplay v-if="episode.isConverted" :poster="movie.coverUrl" :key="episode.id">
+        <source v-if="episode.hlsPlaylistUrl" :src="episode.hlsPlaylistUrl" type="application/vnd.apple.mpegurl">
         <source :src="episode.convertedVideoUrl" type="video/mp4">
         <track v-if="subtitlesExistEn" label="English" kind="captions" srclang="en" :src="episode.subtitlesUrl('vtt', 'eng')" default>
         <track v-if="subtitlesExistFr" label="French" kind="captions" srclang="fr" :src="episode.subtitlesUrl('vtt', 'fre')">
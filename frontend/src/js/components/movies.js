@@ -7,6 +7,7 @@ export default Vue.component('movies', {
   data() {
     return {
       queryDebounceTimeout: null,
+      userStateInterval: null,
       cleaningMode: false,
       isAdmin: false,
       showFilters: false,
@@ -122,9 +123,15 @@ export default Vue.component('movies', {
     },
   },
   async created() {
-    this.$store.dispatch('movies/getMovies');
+    this.$store.dispatch('movies/getMovies').then(() => {
+      this.$store.dispatch('movies/refreshUserState');
+    });
+    this.userStateInterval = setInterval(() => this.$store.dispatch('movies/refreshUserState'), 60000);
     this.isAdmin = (await this.$store.dispatch('users/getUserSettings')).isAdmin;
   },
+  beforeDestroy() {
+    clearInterval(this.userStateInterval);
+  },
   methods: {
     getQueryStringBool(key, defaultVal=false){
       if(defaultVal === true){
@@ -230,7 +237,10 @@ export default Vue.component('movies', {
       <div class="covers">
         <div class="cover" v-for="movie in filteredMovies" :key="movie.tmdbId">
           <progress v-if="movie.percentSeen && movie.percentSeen !== 100" :value="movie.percentSeen" :max="100"/>
-          <img @click="cleaningMode ? deleteOriginalVideos(movie) : openMovie(movie)" :src="movie.coverUrl" :alt="movie.title" loading="lazy"/>
+          <picture @click="cleaningMode ? deleteOriginalVideos(movie) : openMovie(movie)">
+            <source v-if="movie.coverWebpSrcset" type="image/webp" :srcset="movie.coverWebpSrcset" sizes="(max-width: 800px) 50vw, 25vw">
+            <img :src="movie.coverUrl" :srcset="movie.coverJpegSrcset || null" sizes="(max-width: 800px) 50vw, 25vw" :alt="movie.title" loading="lazy"/>
+          </picture>
           <span class="cover-title" v-text="movie.title"></span>
           <div class="icons">
             <star :movie="movie"></star>
@@ -117,6 +117,21 @@ export class Movie {
     return this.episodeList[0].releaseYear;
   }
 
+  get coverWebpSrcset() {
+    return this.coverSrcset('webpUrl');
+  }
+
+  get coverJpegSrcset() {
+    return this.coverSrcset('jpegUrl');
+  }
+
+  coverSrcset(urlKey) {
+    // Spaces and commas separate the URLs in a srcset
+    return (this.coverThumbnails || [])
+      .map(t => `${encodeURI(t[urlKey]).replace(/,/g, '%2C')} ${t.width}w`)
+      .join(', ');
+  }
+
   get dateAdded() {
     return moment.max(this.episodeList.map(p => p.dateAdded));
   }
@@ -6,11 +6,12 @@ export default class {
     const responseJson = await response.json();
     return responseJson.movies.map(jsonMovie => {
       const movie = new Movie();
-      movie.isStarred = !!jsonMovie.isStarred;
+      movie.isStarred = false;
       movie.tmdbId = jsonMovie.tmdbId;
       movie.title = jsonMovie.title;
       movie.description = jsonMovie.description;
       movie.coverUrl = jsonMovie.coverUrl;
+      movie.coverThumbnails = jsonMovie.coverThumbnails;
       movie.mediaType = jsonMovie.mediaType;
       movie.episodeMap = jsonMovie.episodes.reduce(
         (episodes, jsonEpisode) => {
@@ -19,14 +20,16 @@ export default class {
           episode.season = jsonEpisode.season;
           episode.episode = jsonEpisode.episode;
           episode.conversionStatus = jsonEpisode.conversionStatus;
-          episode.lastWatched = jsonEpisode.lastWatched ? moment(jsonEpisode.lastWatched) : null;
+          episode.lastWatched = null;
           episode.originalVideoUrl = jsonEpisode.originalVideoUrl;
+          episode.hlsPlaylistUrl = jsonEpisode.hlsPlaylistUrl;
           episode.releaseYear = jsonEpisode.releaseYear;
-          episode.progress = jsonEpisode.progress;
+          episode.progress = 0;
           episode.duration = jsonEpisode.duration;
           episode.dateAdded = moment(jsonEpisode.dateAdded);
           episode.hasOriginalVersion = jsonEpisode.hasOriginalVersion;
           episode.hasSubtitles = jsonEpisode.hasSubtitles;
+          episode.subtitleLanguages = jsonEpisode.subtitleLanguages;
           episodes[episode.id] = episode;
           return episodes;
         },
@@ -36,10 +39,30 @@ export default class {
     });
   }
 
+  // Watch progress and starred movies of the current user. If `since` is set, only returns the watch progress that
+  // changed since that timestamp.
+  static async getUserState(since=null) {
+    const url = since === null ? '/api/movies/user-state/' : `/api/movies/user-state/?since=${since}`;
+    const responseJson = await fetch(url).then(r => r.json());
+    return {
+      timestamp: responseJson.timestamp,
+      watchStatuses: responseJson.watchStatuses.map(jsonWatchStatus => ({
+        episodeId: jsonWatchStatus.episodeId,
+        progress: jsonWatchStatus.progress,
+        lastWatched: jsonWatchStatus.lastWatched ? moment(jsonWatchStatus.lastWatched) : null,
+      })),
+      starredMovies: new Set(responseJson.starredMovies),
+    };
+  }
+
   static markAsWatched(id) {
     return fetch(`/api/episodes/${id}/watched/`, {method: 'POST'}).then(r => r.json());
   }
 
+  static prioritizeConversion(id) {
+    return fetch(`/api/episodes/${id}/prioritize/`, {method: 'POST'}).then(r => r.json());
+  }
+
   static markAsUnwatched(id) {
     return fetch(`/api/episodes/${id}/unwatched/`, {method: 'POST'}).then(r => r.json());
   }
@@ -120,6 +143,15 @@ export default class {
   }
 
   static async subtitlesExist(episode, fileType='srt'){
+    if (episode.subtitleLanguages) {
+      const languages = episode.subtitleLanguages[fileType];
+      return {
+        en: languages.includes('eng'),
+        fr: languages.includes('fre'),
+        de: languages.includes('ger'),
+      }
+    }
+
     function fileExists(url) {
       return fetch(url, {method: 'HEAD', cache: 'no-cache'}).then(r => r.ok).catch(err => false)
     };
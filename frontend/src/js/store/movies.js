@@ -8,6 +8,7 @@ export default {
     movies: {},
     moviesRequestStatus: RequestStatus.NONE,
     moviesRequestPromise: null,
+    userStateTimestamp: null,
   },
   mutations: {
     SET_MOVIES(state, movies) {
@@ -19,6 +20,21 @@ export default {
         {}
       );
     },
+    SET_USER_STATE(state, userState) {
+      const movies = Object.values(state.movies);
+      const episodes = movies.reduce((episodes, movie) => Object.assign(episodes, movie.episodeMap), {});
+      userState.watchStatuses.forEach(watchStatus => {
+        const episode = episodes[watchStatus.episodeId];
+        if (episode) {
+          episode.progress = watchStatus.progress;
+          episode.lastWatched = watchStatus.lastWatched;
+        }
+      });
+      movies.forEach(movie => {
+        movie.isStarred = userState.starredMovies.has(String(movie.tmdbId));
+      });
+      state.userStateTimestamp = userState.timestamp;
+    },
     DELETE_EPISODE(state, {tmdbId, episodeId}) {
       Vue.delete(state.movies[tmdbId].episodeMap, episodeId);
       if(state.movies[tmdbId].episodeList.length === 0) {
@@ -60,9 +76,10 @@ export default {
     async getMovies(context, forceRefresh = false) {
       if (context.state.moviesRequestStatus === RequestStatus.NONE || forceRefresh) {
         context.commit('MOVIES_REQUEST_PENDING');
-        const moviesRequestPromise = MoviesService.getMovies()
-          .then(movies => {
+        const moviesRequestPromise = Promise.all([MoviesService.getMovies(), MoviesService.getUserState()])
+          .then(([movies, userState]) => {
             context.commit('SET_MOVIES', movies);
+            context.commit('SET_USER_STATE', userState);
             context.commit('MOVIES_REQUEST_SUCCESS');
             return context.state.movies;
           })
@@ -76,6 +93,14 @@ export default {
       }
       return context.state.moviesRequestPromise;
     },
+    async refreshUserState(context) {
+      // Only fetch the progress that changed since the last refresh
+      if (context.state.moviesRequestStatus !== RequestStatus.SUCCESS) {
+        return;
+      }
+      const userState = await MoviesService.getUserState(context.state.userStateTimestamp);
+      context.commit('SET_USER_STATE', userState);
+    },
     async getMovie(context, tmdbId) {
       const movies = await context.dispatch('getMovies');
       return movies[tmdbId];